@@ -1,35 +1,209 @@
+from __future__ import print_function
+
+import os
 import re
 import inspect
 import collections
+import functools
 import abc
+import array
+import atexit
+import itertools
+import logging
+import numbers
+import random
+import sys
+import threading
+import time
+import types
+import weakref
+
+try:
+  import contextvars
+except ImportError:
+  contextvars = None
+
+try:
+  import reprlib
+except ImportError:
+  import repr as reprlib
+
+try:
+  import collections.abc as collections_abc
+except ImportError:
+  collections_abc = collections
 
 __all__ = [
   "typecheck",
   "List",
+  "Iterator",
   "Dict",
   "Optional",
   "Typename",
   "Any",
   "Tuple",
+  "NDArray",
+  "Record",
+  "Union",
+  "Typed",
+  "NotRequired",
   "TypeChecker",
   "TypecheckMeta",
-  "InterfaceMeta"
+  "InterfaceMeta",
+  "SamplingPolicy",
+  "CheckFirst",
+  "CheckRandom",
+  "CheckEvery",
+  "configure",
+  "cache_info",
+  "cache_clear",
+  "FunctionStats",
+  "stats",
+  "stats_report",
+  "reset_stats",
+  "Violation",
+  "LoggingSink",
+  "FileSink",
+  "flush_violations",
+  "TypecheckError",
+  "unchecked"
 ]
 
 
-param_regexp_str = "^\s*:param\s([^:\n\r]+).*$"
+param_regexp_str = r"^\s*:param\s([^:\n\r]+).*$"
 param_regexp = re.compile(param_regexp_str, re.MULTILINE)
 
-returns_regexp_str = "^\s*:returns\s+([^:]+):\s*(.*?)\s*$"
+returns_regexp_str = r"^\s*:returns\s+([^:]+):\s*(.*?)\s*$"
 returns_regexp = re.compile(returns_regexp_str, re.MULTILINE)
 
-type_regexp_str = "^\s*:type\s+([^:]+):\s*(.*?)\s*$"
+type_regexp_str = r"^\s*:type\s+([^:]+):\s*(.*?)\s*$"
 type_regexp = re.compile(type_regexp_str, re.MULTILINE)
 
-rtype_regexp_str = "^\s*:rtype\s*:\s*(.*?)\s*$"
+rtype_regexp_str = r"^\s*:rtype\s*:\s*(.*?)\s*$"
 rtype_regexp = re.compile(rtype_regexp_str, re.MULTILINE)
 
 
+_MODES = ("check", "report", "off")
+
+
+class _Config(object):
+  """Module wide settings. Use configure() to change them.
+
+  The mode, interface_checks, lazy, stats and overhead_budget options can
+  also be set through the SAFETYNET_MODE, SAFETYNET_INTERFACE_CHECKS,
+  SAFETYNET_LAZY, SAFETYNET_STATS and SAFETYNET_OVERHEAD_BUDGET environment
+  variables.
+  """
+  def __init__(self, environ):
+    # "check" to check types on every call, "report" to report violations
+    # without raising, "off" to not decorate functions at all.
+    self.mode = _ValidateMode(environ.get("SAFETYNET_MODE", "check"))
+    # Whether InterfaceMeta checks subclasses at the time of definition.
+    interface_checks = environ.get("SAFETYNET_INTERFACE_CHECKS", "1")
+    self.interface_checks = interface_checks.lower() not in ("0", "off",
+                                                             "false")
+    # Whether to parse docstrings and type checks on the first call of a
+    # function instead of when it is defined.
+    lazy = environ.get("SAFETYNET_LAZY", "0")
+    self.lazy = lazy.lower() not in ("0", "off", "false")
+    # Whether to record the time spent in type checks, see stats().
+    stats = environ.get("SAFETYNET_STATS", "0")
+    self.stats = stats.lower() not in ("0", "off", "false")
+    # Default SamplingPolicy for List and Dict checks that do not define
+    # their own. None checks every item.
+    self.sample = None
+    # Maximum number of validation results of immutable values to cache.
+    self.cache_size = 0
+    # Receives Violations in report mode. Defaults to a LoggingSink.
+    self.report_sink = None
+    # Maximum number of violations buffered until they are reported.
+    self.report_buffer_size = 1024
+    # Minimum number of seconds between reports of the same violation.
+    self.report_interval = 60.0
+    # Maximum ratio of time spent in checks to time spent in the function,
+    # see _OverheadBudget. None always checks everything.
+    self.overhead_budget = _ValidateOverheadBudget(
+        environ.get("SAFETYNET_OVERHEAD_BUDGET") or None)
+    self.UpdateInstrumented()
+
+  def UpdateInstrumented(self):
+    # Whether calls have to go through _TypeChecks.Call to be measured.
+    self._instrumented = bool(self.stats or self.overhead_budget)
+
+
+def _ValidateMode(mode):
+  if mode not in _MODES:
+    raise TypeError("Invalid mode '%s'. Expected one of %s" %
+                    (mode, ", ".join(_MODES)))
+  return mode
+
+
+def _ValidateOverheadBudget(overhead_budget):
+  if overhead_budget is None:
+    return None
+  try:
+    overhead_budget = float(overhead_budget)
+  except ValueError:
+    overhead_budget = 0
+  if overhead_budget <= 0:
+    raise TypeError("Invalid overhead budget '%s'. Expected a positive "
+                    "number" % overhead_budget)
+  return overhead_budget
+
+_config = _Config(os.environ)
+
+
+def configure(**options):
+  """Changes module wide settings.
+
+  The mode needs to be set before any functions or classes are defined, it
+  does not change functions that have already been decorated.
+
+  :param str mode: "check" (default), "report" or "off". With "report",
+    invalid values do not raise TypeError, but are reported to the
+    report_sink. With "off", @typecheck, TypecheckMeta and InterfaceMeta
+    return functions undecorated. Neither docstrings nor type checks are
+    parsed.
+  :param bool interface_checks: Whether InterfaceMeta checks the argument
+    names and public methods of subclasses. Defaults to True.
+  :param bool lazy: Parse docstrings and type checks on the first call of
+    each function instead of when it is defined. Errors in type checks are
+    then only raised on the first call. Defaults to False.
+  :param bool stats: Record the number of calls, failures and time spent in
+    type checks of each function, see stats(). Can be changed at any time.
+    Defaults to False.
+  :param sample: Default SamplingPolicy (or number of leading items to check)
+    used by List and Dict checks that do not specify their own.
+  :param int cache_size: Number of validation results of tuples and
+    frozensets to remember, see cache_info(). Defaults to 0 (disabled).
+  :param report_sink: Callable receiving each Violation in report mode, e.g.
+    a LoggingSink (the default) or FileSink. Called from a background
+    thread.
+  :param int report_buffer_size: Maximum number of violations buffered
+    between reports. Further violations are dropped. Defaults to 1024.
+  :param float report_interval: Minimum number of seconds between reports of
+    the same violation. Repeated violations are counted in between.
+    Defaults to 60.
+  :param float overhead_budget: Maximum ratio of time spent in checks to time
+    spent in the function itself. Functions exceeding it are checked less
+    thoroughly, see stats(). Each decision is logged to the "safetynet"
+    logger. Ignored while stats are enabled. Defaults to None (disabled).
+  """
+  for name, value in options.items():
+    if name.startswith("_") or not hasattr(_config, name):
+      raise TypeError("Unknown option '%s'" % name)
+    if name == "mode":
+      value = _ValidateMode(value)
+    elif name == "overhead_budget":
+      value = _ValidateOverheadBudget(value)
+    elif name == "sample":
+      value = _SamplingPolicyFor(value)
+    elif name == "report_buffer_size":
+      _violation_reporter.Resize(value)
+    setattr(_config, name, value)
+  _config.UpdateInstrumented()
+
+
 class TypecheckMeta(abc.ABCMeta):
   """ Metaclass to automatically decorate all members with @typecheck
 
@@ -37,14 +211,23 @@ class TypecheckMeta(abc.ABCMeta):
   typechecks and also allows this class to automatically inherit it's method's
   types to subclasses. This allows the user to override methods without
   re-defining the types.
+
+  Each class stores an index of its members and the members it inherits from
+  all parents, including mixins and builtin bases, see IndexMembers.
+  Subclasses look up parent members in the merged indexes of their parents
+  instead of inspecting the parents.
   """
   def __new__(cls, class_name, parents, dct):
-    typecheck_parent = cls.FindTypecheckParent(parents)
+    if _config.mode == "off":
+      return cls.CreateClass(class_name, parents, dct)
+
+    inherited_members = cls.InheritedMembers(parents)
     for name, member in cls.ListMembersOfInterest(dct):
-      parent_member = cls.FindParentMember(typecheck_parent, name)
+      parent_member = inherited_members.get(name)
       dct[name] = cls.Decorate(class_name, member, parent_member)
 
-    return abc.ABCMeta.__new__(cls, class_name, parents, dct)
+    cls.IndexMembers(class_name, dct, inherited_members)
+    return cls.CreateClass(class_name, parents, dct)
 
   @classmethod
   def ListMembersOfInterest(cls, dct):
@@ -72,29 +255,85 @@ class TypecheckMeta(abc.ABCMeta):
 
   @classmethod
   def DecorateMethod(cls, class_name, method, parent_member):
-    if hasattr(method, "type_check_dict"):
+    if _config.mode == "off" or hasattr(method, "type_checks"):
       return method
 
-    parent_type_check_dict = {}
-    if parent_member and hasattr(parent_member, "type_check_dict"):
-      parent_type_check_dict = parent_member.type_check_dict
+    parent_type_checks = {}
+    if parent_member and parent_member.type_checks is not None:
+      parent_type_checks = parent_member.type_checks
 
-    return _TypecheckFunction(method, parent_type_check_dict, 4, class_name)
+    return _TypecheckFunction(method, parent_type_checks, 4, class_name)
+
+  @classmethod
+  def CreateClass(cls, class_name, parents, dct):
+    """Creates the class and binds its Typed attributes.
+
+    Typed attributes are removed from dct, so they are read like plain
+    attributes. If the class defines __slots__, a slot is added for each.
+    """
+    typed_attributes = dict((name, member) for name, member in dct.items()
+                            if isinstance(member, TypedAttribute))
+    for name in typed_attributes:
+      del dct[name]
+    if typed_attributes and "__slots__" in dct:
+      slots = dct["__slots__"]
+      if isinstance(slots, str):
+        slots = (slots,)
+      dct["__slots__"] = tuple(slots) + tuple(sorted(typed_attributes))
+
+    new_class = abc.ABCMeta.__new__(cls, class_name, parents, dct)
+    if typed_attributes and _config.mode != "off":
+      _BindTypedAttributes(new_class, typed_attributes)
+    return new_class
 
   @classmethod
   def FindTypecheckParent(cls, parents):
     """Find parent class that uses this metaclass."""
     for parent in parents:
-      if hasattr(parent, "__metaclass__") and parent.__metaclass__ == cls:
+      if isinstance(parent, cls):
         return parent
     return None
 
   @classmethod
-  def FindParentMember(cls, typecheck_parent, name):
-    """Returns member by name from parent class if it exists."""
-    if typecheck_parent and hasattr(typecheck_parent, name):
-      return getattr(typecheck_parent, name)
-    return None
+  def InheritedMembers(cls, parents):
+    """Returns the index of all members the new class inherits.
+
+    Follows the MRO of the new class. The longest tail of the MRO that is the
+    MRO of a class created by this metaclass is taken from its stored index,
+    usually that of the first parent. Members of the classes before it,
+    including mixins and builtin bases, are indexed here.
+    """
+    mro = _Linearize(parents)
+    for position, base in enumerate(mro):
+      index = vars(base).get("_typecheck_members")
+      if index is not None and inspect.getmro(base) == tuple(mro[position:]):
+        inherited_members = dict(index)
+        break
+    else:
+      position = len(mro)
+      inherited_members = {}
+    for base in reversed(mro[:position]):
+      cls.AddMembers(inherited_members, base.__name__, vars(base))
+    return inherited_members
+
+  @classmethod
+  def IndexMembers(cls, class_name, dct, inherited_members):
+    """Stores the index of all members of the new class in dct.
+
+    The index maps member names to _IndexedMember, including members
+    inherited from all parents.
+    """
+    members = dict(inherited_members)
+    cls.AddMembers(members, class_name, dct)
+    dct["_typecheck_members"] = members
+
+  @classmethod
+  def AddMembers(cls, members, class_name, dct):
+    """Adds an _IndexedMember for each member in dct of class_name."""
+    for name, member in dct.items():
+      if ((not name.endswith("__") or name == "__init__") and
+          name != "_typecheck_members"):
+        members[name] = _IndexedMember(name, class_name, member)
 
 
 class InterfaceMeta(TypecheckMeta):
@@ -102,35 +341,38 @@ class InterfaceMeta(TypecheckMeta):
 
   Classes defined with his meta class will not allow any subclasses that
   override it's public methods with different argument names, nor any other
-  public methods.
+  public methods. These checks can be disabled with
+  configure(interface_checks=False).
   """
   def __new__(cls, class_name, parents, dct):
     typecheck_parent = cls.FindTypecheckParent(parents)
+    inherited_members = cls.InheritedMembers(parents)
+    decorate = _config.mode != "off"
 
     for name, member in cls.ListMembersOfInterest(dct):
-      parent_member = cls.FindParentMember(typecheck_parent, name)
-      if typecheck_parent and name != "__init__":
-        cls.CheckOverridenArgumentNames(class_name, member, parent_member,
-                                        typecheck_parent)
+      parent_member = inherited_members.get(name)
+      if (_config.interface_checks and typecheck_parent and
+          name != "__init__"):
+        cls.CheckOverridenArgumentNames(class_name, member, parent_member)
         cls.CheckUndefinedPublicMethod(class_name, name,
                                        typecheck_parent.__name__,
                                        parent_member)
-      dct[name] = cls.Decorate(class_name, member, parent_member)
+      if decorate:
+        dct[name] = cls.Decorate(class_name, member, parent_member)
 
     # Note: We are not calling TypeCheckMeta.__new__ since we decorated all
     # members already.
-    return abc.ABCMeta.__new__(cls, class_name, parents, dct)
+    cls.IndexMembers(class_name, dct, inherited_members)
+    return cls.CreateClass(class_name, parents, dct)
 
   @classmethod
-  def CheckOverridenArgumentNames(cls, class_name, member, parent_member,
-                                  typecheck_parent):
-    if parent_member and hasattr(parent_member, "wrapped_function"):
-      parent_arg_names = inspect.getargspec(parent_member.wrapped_function)[0]
-      arg_names = inspect.getargspec(member)[0]
-      if parent_arg_names != arg_names:
+  def CheckOverridenArgumentNames(cls, class_name, member, parent_member):
+    if (parent_member and parent_member.function and
+        inspect.isfunction(member)):
+      if parent_member.ArgNames() != _GetArgNames(member):
         message = "Overriding %s.%s in %s with different argument names"
-        message = message % (parent_member.im_class.__name__,
-                             parent_member.__name__, class_name)
+        message = message % (parent_member.class_name, parent_member.name,
+                             class_name)
         raise TypeError(message)
 
   @classmethod
@@ -141,6 +383,79 @@ class InterfaceMeta(TypecheckMeta):
       message = message % (class_name, member_name, parent_name)
       raise TypeError(message)
 
+def _Linearize(parents):
+  """Returns the MRO of a new class with parents, without the class itself.
+
+  Uses the C3 linearization of Python, see inspect.getmro.
+  """
+  if len(parents) == 1:
+    return list(inspect.getmro(parents[0]))
+  sequences = [list(inspect.getmro(parent)) for parent in parents]
+  return _MergeMros(sequences + [list(parents)])
+
+
+def _MergeMros(sequences):
+  """Merges the MROs of the parents and the parents themselves, see C3.
+
+  Raises TypeError if there is no consistent order.
+  """
+  sequences = [list(sequence) for sequence in sequences]
+  mro = []
+  while True:
+    sequences = [sequence for sequence in sequences if sequence]
+    if not sequences:
+      return mro
+    for sequence in sequences:
+      head = sequence[0]
+      if not any(head in other[1:] for other in sequences):
+        break
+    else:
+      raise TypeError("Cannot create a consistent method resolution order")
+    mro.append(head)
+    for sequence in sequences:
+      if sequence[0] == head:
+        del sequence[0]
+
+
+class _IndexedMember(object):
+  """A member of a class created by TypecheckMeta, see IndexMembers.
+
+  Holds what subclasses need to know about the member, so they do not have
+  to inspect it again.
+  """
+  __slots__ = ("name", "class_name", "function", "type_checks",
+               "_arg_names")
+
+  def __init__(self, name, class_name, member):
+    self.name = name
+    self.class_name = class_name
+    self.function = _UnwrapFunction(member)
+    self.type_checks = getattr(member, "type_checks", None)
+    self._arg_names = None
+
+  def ArgNames(self):
+    """Returns the names of the positional arguments of the function."""
+    if self._arg_names is None:
+      self._arg_names = _GetArgNames(self.function)
+    return self._arg_names
+
+
+def _GetArgNames(function):
+  """Returns the names of the positional arguments of function."""
+  if hasattr(inspect, "getfullargspec"):
+    return inspect.getfullargspec(function).args
+  return inspect.getargspec(function).args
+
+
+def _UnwrapFunction(member):
+  """Returns the plain function of a (typechecked) method or None."""
+  member = getattr(member, "__func__", member)
+  member = getattr(member, "wrapped_function", member)
+  if inspect.isfunction(member):
+    return member
+  return None
+
+
 def _FormatTypeCheck(type_):
   """Pretty format of type check."""
   if isinstance(type_, tuple):
@@ -153,29 +468,387 @@ def _FormatTypeCheck(type_):
 
 
 class TypeChecker(object):
-  """Baseclass for all TypeCheckers."""
-  pass
+  """Baseclass for all TypeCheckers.
+
+  Subclasses implement Compile() to return a function validating a single
+  value. Calling the checker compiles it on first use.
+
+  Checkers are values: The slots listed in _fields are set once by _Init and
+  can not be changed afterwards. Checkers of the same type with equal fields
+  compare and hash equal, so they can be used as dictionary keys. Checkers
+  without fields compare by identity.
+  """
+  __slots__ = ("_predicate", "__weakref__")
+  _fields = ()
+
+  def __init__(self):
+    self._Init()
+
+  def _Init(self, *values):
+    """Sets the fields of the checker to values, in order of _fields."""
+    for name, value in zip(self._fields, values):
+      object.__setattr__(self, name, value)
+    object.__setattr__(self, "_predicate", None)
+
+  def _Values(self):
+    return tuple(getattr(self, name) for name in self._fields)
+
+  def __setattr__(self, name, value):
+    if name in self._fields or name == "_predicate":
+      raise AttributeError("%s is immutable" % type(self).__name__)
+    object.__setattr__(self, name, value)
+
+  def __delattr__(self, name):
+    if name in self._fields or name == "_predicate":
+      raise AttributeError("%s is immutable" % type(self).__name__)
+    object.__delattr__(self, name)
+
+  def __eq__(self, other):
+    if not self._fields:
+      return self is other
+    return type(self) is type(other) and self._Values() == other._Values()
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    if not self._fields:
+      return object.__hash__(self)
+    return hash((type(self), self._Values()))
+
+  def __reduce__(self):
+    return type(self), self._Values()
+
+  def Compile(self):
+    """Returns a function that validates a single value.
+
+    Checkers that implement __call__ directly do not need to override this.
+    """
+    return self.__call__
+
+  def Explain(self, value):
+    """Returns (path, item, item_type) of an invalid item of value.
+
+    path is the index or key of the item, e.g. "[3]". Returns None if value
+    itself is invalid or the checker has no items. Only used to format
+    errors, so it may be slow.
+    """
+    return None
+
+  def Shallow(self):
+    """Returns a checker that does not visit the items of containers.
+
+    Used to reduce the cost of checks, see configure(overhead_budget=...).
+    """
+    return self
+
+  def ChecksTypesOnly(self):
+    """Returns True if results only depend on the types of a value.
+
+    Results of such checks of the items of tuples and frozensets are cached,
+    see _ValidationCache. Checks of the contents of items, e.g. of lists or
+    by predicates, can change without the item being replaced.
+    """
+    return False
+
+  def CompileItemCheck(self):
+    """Returns a function validating the items of an iterator or None.
+
+    Iterators passed as arguments or returned from a function are not
+    validated by the predicate returned by Compile(), but wrapped to have
+    each item validated by this function when it is pulled from the
+    iterator. None if the checker does not allow iterators.
+    """
+    return None
+
+  def __call__(self, value):
+    predicate = getattr(self, "_predicate", None)
+    if predicate is None:
+      predicate = self.Compile()
+      object.__setattr__(self, "_predicate", predicate)
+    return predicate(value)
 
 
 class TypeCheckerFactory(object):
+  """Creates TypeCheckers, e.g. List[int].
+
+  Checkers are shared: Creating a checker with the same arguments twice
+  returns the same instance, so it is only compiled once. Instances are
+  referenced weakly, so they and the types they check are released once no
+  longer used.
+  """
   def __init__(self, type_check_type):
     self.type_check_type = type_check_type
+    self.instances = weakref.WeakValueDictionary()
 
   def __getitem__(self, args_tuple):
     if not isinstance(args_tuple, tuple):
       args_tuple = (args_tuple,)
-    return self.type_check_type(*args_tuple)
+    return self.__call__(*args_tuple)
+
+  def __call__(self, *args, **kwargs):
+    """Allows passing options that are not possible with [], e.g.:
+
+    List(int, sample=32)
+    """
+    # The types are part of the key since e.g. 1 == 1.0 == True.
+    key = (args, tuple(type(arg) for arg in args),
+           tuple(sorted(kwargs.items())))
+    try:
+      instance = self.instances.get(key)
+    except TypeError:
+      # Unhashable arguments can not be shared.
+      return self.type_check_type(*args, **kwargs)
+    if instance is None:
+      instance = self.instances.setdefault(key,
+                                           self.type_check_type(*args,
+                                                                **kwargs))
+    return instance
+
+
+class SamplingPolicy(object):
+  """Baseclass for policies limiting which items of a container are checked.
+
+  Used by List and Dict checks to bound the cost of a check independent of
+  the size of the container.
+  """
+  def Select(self, value):
+    """Returns an iterable of the items (or keys of a mapping) to check."""
+    raise NotImplementedError()
+
+  # Policies of the same type with equal attributes are equal, so checkers
+  # using them are too.
+  def __eq__(self, other):
+    return type(self) is type(other) and vars(self) == vars(other)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash((type(self), tuple(sorted(vars(self).items()))))
+
+
+class CheckFirst(SamplingPolicy):
+  """Checks only the first count items."""
+  def __init__(self, count):
+    self.count = count
+
+  def Select(self, value):
+    return itertools.islice(value, self.count)
+
+  def __repr__(self):
+    return "CheckFirst(%d)" % self.count
+
+
+class CheckRandom(SamplingPolicy):
+  """Checks count randomly picked items.
+
+  Random items can only be picked from sequences, of other containers the
+  first count items are checked.
+  """
+  def __init__(self, count):
+    self.count = count
+
+  def Select(self, value):
+    if not _IsSequence(value):
+      return itertools.islice(value, self.count)
+    length = len(value)
+    if length <= self.count:
+      return value
+    return [value[random.randrange(length)] for _ in range(self.count)]
+
+  def __repr__(self):
+    return "CheckRandom(%d)" % self.count
+
+
+class CheckEvery(SamplingPolicy):
+  """Checks all items, but only on one in calls calls."""
+  def __init__(self, calls):
+    self.calls = calls
+    self.counter = itertools.cycle(range(calls))
+
+  def Select(self, value):
+    if next(self.counter) == 0:
+      return value
+    return ()
+
+  def __repr__(self):
+    return "CheckEvery(%d)" % self.calls
+
+
+def _SamplingPolicyFor(sample):
+  """Converts the sample option of a check into a SamplingPolicy.
+
+  Numbers are shorthand for CheckFirst. None and False are passed through,
+  meaning "use the module default" and "check every item" respectively.
+  """
+  if sample is None or sample is False or isinstance(sample, SamplingPolicy):
+    return sample
+  if isinstance(sample, numbers.Integral):
+    return CheckFirst(sample)
+  raise TypeError("Invalid sample option '%s'" % repr(sample))
+
+
+CacheInfo = collections.namedtuple("CacheInfo",
+                                   "hits misses maxsize currsize")
+
+
+class _ValidationCache(object):
+  """Least recently used cache of validation results for immutable values.
+
+  Only tuples and frozensets are cached. Their items can not be replaced,
+  but they can still change their state, so callers only cache checks of
+  items that depend on types alone, see _ChecksTypesOnly. Entries are keyed
+  by the identity of the value, which is never hashed, so hits cost the same
+  for any size. Values are referenced weakly where possible, otherwise the
+  entry keeps the value alive so its id can not be reused while it is
+  cached.
+  """
+  cacheable_types = (tuple, frozenset)
+
+  def __init__(self):
+    self.entries = collections.OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def Validate(self, value, check_key, validate):
+    """Returns validate(value), cached if value is immutable.
+
+    :param check_key: Hashable key identifying the check done by validate.
+    """
+    maxsize = _config.cache_size
+    if not maxsize or type(value) not in self.cacheable_types:
+      return validate(value)
+
+    key = (id(value), check_key)
+    with self.lock:
+      try:
+        entry = self.entries.pop(key, None)
+      except TypeError:
+        # Custom type checks may not be hashable.
+        return validate(value)
+      if entry is not None:
+        reference, result = entry
+        if reference is value or (isinstance(reference, weakref.ref) and
+                                  reference() is value):
+          self.entries[key] = entry
+          self.hits += 1
+          return result
+      self.misses += 1
+
+    result = validate(value)
+    try:
+      reference = weakref.ref(value)
+    except TypeError:
+      reference = value
+    with self.lock:
+      self.entries[key] = (reference, result)
+      while len(self.entries) > maxsize:
+        self.entries.popitem(last=False)
+    return result
+
+  def Info(self):
+    return CacheInfo(self.hits, self.misses, _config.cache_size,
+                     len(self.entries))
+
+  def Clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+_validation_cache = _ValidationCache()
+
+
+def cache_info():
+  """Returns hits, misses, maxsize and currsize of the validation cache.
+
+  The cache is disabled by default, use configure(cache_size=...) to enable.
+  """
+  return _validation_cache.Info()
+
+
+def cache_clear():
+  """Removes all results and resets the statistics of the validation cache."""
+  _validation_cache.Clear()
+
+
+if hasattr(abc, "get_cache_token"):
+  _AbcCacheToken = abc.get_cache_token
+else:
+  def _AbcCacheToken():
+    return abc.ABCMeta._abc_invalidation_counter
+
+# Maximum number of types remembered by each _CompileTypeDispatch function.
+_max_dispatch_types = 1024
+
+_old_style_instance = getattr(types, "InstanceType", None)
+
+
+def _CompileTypeDispatch(predicate):
+  """Returns a function caching predicate(value) by the type of value.
+
+  For predicates that only depend on the type of the value, e.g. ABC
+  isinstance checks. Like the dispatch cache of functools.singledispatch,
+  results are discarded whenever a class is registered with any ABC, so
+  repeated checks of the same type only cost a dict lookup. Types are
+  referenced strongly, but at most _max_dispatch_types of them.
+  """
+  results = {}
+  tokens = [_AbcCacheToken()]
+
+  def Dispatch(value):
+    token = _AbcCacheToken()
+    if token != tokens[0]:
+      results.clear()
+      tokens[0] = token
+    value_type = type(value)
+    result = results.get(value_type)
+    if result is None:
+      result = bool(predicate(value))
+      # All old-style instances share one type.
+      if value_type is not _old_style_instance:
+        if len(results) >= _max_dispatch_types:
+          results.clear()
+        results[value_type] = result
+    return result
+  return Dispatch
+
+_IsIterable = _CompileTypeDispatch(
+    lambda value: isinstance(value, collections_abc.Iterable))
+_IsMapping = _CompileTypeDispatch(
+    lambda value: isinstance(value, collections_abc.Mapping))
+_IsSequence = _CompileTypeDispatch(
+    lambda value: isinstance(value, collections_abc.Sequence))
 
 
 class OptionalChecker(TypeChecker):
   """Allows either None or subtype."""
+  __slots__ = ("subtype",)
+  _fields = __slots__
+
   def __init__(self, subtype=None):
-    self.subtype = subtype
+    self._Init(subtype)
 
-  def __call__(self, value):
-    if value is not None and self.subtype is not None:
-      return _ValidateValue(value, self.subtype)
-    return True
+  def Compile(self):
+    if self.subtype is None:
+      return lambda value: True
+    subtype_predicate = _CompileTypeCheck(self.subtype)
+    return lambda value: value is None or subtype_predicate(value)
+
+  def Explain(self, value):
+    if value is None or self.subtype is None:
+      return None
+    return "", value, self.subtype
+
+  def Shallow(self):
+    if self.subtype is None:
+      return self
+    return Optional[_ShallowTypeCheck(self.subtype)]
+
+  def ChecksTypesOnly(self):
+    return self.subtype is None or _ChecksTypesOnly(self.subtype)
 
   def __repr__(self):
     return "Optional[%s]" % (_FormatTypeCheck(self.subtype)
@@ -185,9 +858,14 @@ Optional = TypeCheckerFactory(OptionalChecker)
 
 
 class AnyChecker(TypeChecker):
-  """Allows either None or subtype."""
-  def __call__(self, value):
-    return value is not None
+  """Allows any value except None."""
+  __slots__ = ()
+
+  def Compile(self):
+    return lambda value: value is not None
+
+  def ChecksTypesOnly(self):
+    return True
 
   def __repr__(self):
     return "Any"
@@ -197,12 +875,20 @@ Any = AnyChecker()
 
 class TypenameChecker(TypeChecker):
   """Allows only objects of a type with the name type_name."""
+  __slots__ = ("type_name",)
+  _fields = __slots__
+
   def __init__(self, type_name=None):
-    self.type_name = type_name
+    self._Init(type_name)
 
-  def __call__(self, value):
-    if self.type_name:
-      return type(value).__name__ == self.type_name
+  def Compile(self):
+    type_name = self.type_name
+    if not type_name:
+      return lambda value: True
+    return _CompileTypeDispatch(
+        lambda value: type(value).__name__ == type_name)
+
+  def ChecksTypesOnly(self):
     return True
 
   def __repr__(self):
@@ -214,47 +900,147 @@ Typename = TypeCheckerFactory(TypenameChecker)
 class ListChecker(TypeChecker):
   """Allows only iterable objects with all items being of item_type.
 
-  If item_type is none, any item type is allowed.
+  If item_type is none, any item type is allowed. sample limits which items
+  are checked, see SamplingPolicy.
+
+  Arrays, buffers and strings are validated without visiting each item if
+  item_type is a class, since all of their items have the same type.
+
+  Iterators passed as arguments or returned are not consumed, their items
+  are checked when the function pulls them. See Iterator.
   """
-  def __init__(self, item_type=None):
-    self.item_type = item_type
+  __slots__ = ("item_type", "sample")
+  _fields = __slots__
 
-  def __call__(self, value):
-    if not isinstance(value, collections.Iterable):
-      return False
-    if self.item_type is not None:
-      for item in value:
-        if not _ValidateValue(item, self.item_type):
+  def __init__(self, item_type=None, sample=None):
+    self._Init(item_type, _SamplingPolicyFor(sample))
+
+  def Compile(self):
+    if self.item_type is None:
+      return _IsIterable
+
+    own_sample = self.sample
+    validate_items = _CompileItemsCheck(self.item_type)
+    check_key = ("items", self.item_type)
+    cacheable = _ChecksTypesOnly(self.item_type)
+
+    item_type = self.item_type
+    is_class = inspect.isclass(item_type)
+
+    def ValidateList(value):
+      value_type = type(value)
+      if value_type is not list:
+        if not _IsIterable(value):
           return False
-    return True
+        if is_class:
+          valid = _ValidateArrayItems(value, item_type)
+          if valid is not None:
+            return valid
+      sample = own_sample if own_sample is not None else _config.sample
+      if sample:
+        return validate_items(sample.Select(value))
+      if value_type is list or not cacheable:
+        return validate_items(value)
+      return _validation_cache.Validate(value, check_key, validate_items)
+    return ValidateList
+
+  def Shallow(self):
+    return List()
+
+  def Explain(self, value):
+    if (self.item_type is None or
+        not _IsIterable(value) or _IsIterator(value)):
+      return None
+    predicate = _CompileTypeCheck(self.item_type)
+    for index, item in enumerate(value):
+      if not predicate(item):
+        return "[%d]" % index, item, self.item_type
+    return None
 
   def __repr__(self):
     subtype = _FormatTypeCheck(self.item_type) if self.item_type else ""
+    if self.sample is not None:
+      subtype += ", sample=%r" % self.sample
     return "Iterable[%s]" % subtype
 
+  def CompileItemCheck(self):
+    if self.item_type is None:
+      return None
+    return _CompileTypeCheck(self.item_type)
+
 List = TypeCheckerFactory(ListChecker)
 
 
+class IteratorChecker(TypeChecker):
+  """Allows iterables with all items being of item_type.
+
+  Unlike List, this check never consumes iterators or generators, not even
+  when nested in other checks. Iterators passed as arguments or returned
+  from a function are wrapped to check each item when it is pulled, other
+  iterators are only checked to be iterable. Other iterables (e.g. lists)
+  are checked completely.
+  """
+  __slots__ = ("item_type",)
+  _fields = __slots__
+
+  def __init__(self, item_type=None):
+    self._Init(item_type)
+
+  def Compile(self):
+    list_predicate = List[self.item_type].Compile()
+    return lambda value: _IsIterator(value) or list_predicate(value)
+
+  def Explain(self, value):
+    return List[self.item_type].Explain(value)
+
+  def Shallow(self):
+    return Iterator()
+
+  def CompileItemCheck(self):
+    if self.item_type is None:
+      return None
+    return _CompileTypeCheck(self.item_type)
+
+  def __repr__(self):
+    subtype = _FormatTypeCheck(self.item_type) if self.item_type else ""
+    return "Iterator[%s]" % subtype
+
+Iterator = TypeCheckerFactory(IteratorChecker)
+
+
+def _IsIterator(value):
+  return _IsIterable(value) and iter(value) is value
+
+
 class TupleChecker(TypeChecker):
   """Allows only iterable objects with all items being of item_type.
 
   If item_type is none, any item type is allowed.
   """
+  __slots__ = ("item_types",)
+  _fields = __slots__
+
   def __init__(self, *item_types):
-    self.item_types = item_types
+    self._Init(item_types)
 
-  def __call__(self, value):
-    if not isinstance(value, tuple):
-      return False
+  def __reduce__(self):
+    return TupleChecker, self.item_types
+
+  def Compile(self):
     if len(self.item_types) == 0:
-      return True
-    if len(self.item_types) != len(value):
-      return False
+      return lambda value: isinstance(value, tuple)
+    return _CompileTypeCheck(self.item_types)
 
-    for item, item_type in zip(value, self.item_types):
-      if not _ValidateValue(item, item_type):
-        return False
-    return True
+  def Explain(self, value):
+    if len(self.item_types) == 0:
+      return None
+    return _ExplainTuple(value, self.item_types)
+
+  def Shallow(self):
+    return Tuple()
+
+  def ChecksTypesOnly(self):
+    return _ChecksTypesOnly(self.item_types)
 
   def __repr__(self):
     subtypes = [_FormatTypeCheck(item_type) for item_type in self.item_types]
@@ -268,34 +1054,403 @@ class DictChecker(TypeChecker):
 
   If key_type is specified, all keys have to be of that type.
   If value_type is specified, all values have to be of that type.
+  sample limits which items are checked, see SamplingPolicy.
   """
-  def __init__(self, key_type=None, value_type=None):
-    self.key_type = key_type
-    self.value_type = value_type
+  __slots__ = ("key_type", "value_type", "sample")
+  _fields = __slots__
 
-  def __call__(self, value):
-    if not isinstance(value, collections.Mapping):
-      return False
-    if self.key_type is not None and self.value_type is not None:
-      for key, item in value.items():
-        if (self.key_type is not None and
-            not _ValidateValue(key, self.key_type)):
-          return False
-        if (self.value_type is not None and
-            not _ValidateValue(item, self.value_type)):
-          return False
-    return True
+  def __init__(self, key_type=None, value_type=None, sample=None):
+    self._Init(key_type, value_type, _SamplingPolicyFor(sample))
+
+  def Compile(self):
+    if self.key_type is None or self.value_type is None:
+      return _IsMapping
+
+    own_sample = self.sample
+    validate_keys = _CompileItemsCheck(self.key_type)
+    validate_values = _CompileItemsCheck(self.value_type)
+
+    def ValidateDict(value):
+      if not _IsMapping(value):
+        return False
+      sample = own_sample if own_sample is not None else _config.sample
+      if sample:
+        keys = list(sample.Select(value))
+        return (validate_keys(keys) and
+                validate_values([value[key] for key in keys]))
+      return validate_keys(value) and validate_values(_IterValues(value))
+    return ValidateDict
+
+  def Shallow(self):
+    return Dict()
+
+  def Explain(self, value):
+    if (self.key_type is None or self.value_type is None or
+        not _IsMapping(value)):
+      return None
+    key_predicate = _CompileTypeCheck(self.key_type)
+    value_predicate = _CompileTypeCheck(self.value_type)
+    for key in value:
+      if not key_predicate(key):
+        return ".keys()", key, self.key_type
+      if not value_predicate(value[key]):
+        return "[%s]" % _short_repr.repr(key), value[key], self.value_type
+    return None
 
   def __repr__(self):
     subtype = ", ".join([
         _FormatTypeCheck(self.key_type) if self.key_type else "",
         _FormatTypeCheck(self.value_type) if self.value_type else ""
     ])
+    if self.sample is not None:
+      subtype += ", sample=%r" % self.sample
     return "Dict[%s]" % subtype
 
+class NDArrayChecker(TypeChecker):
+  """Allows only numpy arrays with matching dtype and number of dimensions.
+
+  dtype can be anything numpy.dtype accepts, or an abstract numpy type like
+  numpy.integer or numpy.floating to allow all of its subtypes. If dtype or
+  ndim are None, they are not checked. The items are never visited.
+
+  NumPy is not imported by this check. If it has not been imported by
+  anyone else, there can not be any arrays and the check always fails.
+  """
+  __slots__ = ("dtype", "ndim")
+  _fields = __slots__
+
+  def __init__(self, dtype=None, ndim=None):
+    self._Init(dtype, ndim)
+
+  def Compile(self):
+    numpy = sys.modules.get("numpy")
+    if numpy is None:
+      return self._CompileOnceImported()
+
+    ndim = self.ndim
+    scalar_type = None
+    if self.dtype is not None:
+      scalar_type = self.dtype
+      if not (inspect.isclass(scalar_type) and
+              issubclass(scalar_type, numpy.generic)):
+        scalar_type = numpy.dtype(self.dtype).type
+
+    def ValidateArray(value):
+      if not isinstance(value, numpy.ndarray):
+        return False
+      if ndim is not None and value.ndim != ndim:
+        return False
+      return scalar_type is None or issubclass(value.dtype.type, scalar_type)
+    return ValidateArray
+
+  def _CompileOnceImported(self):
+    compiled = []
+    def ValidateArray(value):
+      if not compiled:
+        if "numpy" not in sys.modules:
+          return False
+        compiled.append(self.Compile())
+      return compiled[0](value)
+    return ValidateArray
+
+  def __repr__(self):
+    dtype = _FormatTypeCheck(self.dtype) if self.dtype is not None else ""
+    if self.ndim is not None:
+      return "NDArray[%s, %d]" % (dtype, self.ndim)
+    return "NDArray[%s]" % dtype
+
+NDArray = TypeCheckerFactory(NDArrayChecker)
+
+
+# Number of matches of callable Union alternatives after which they are
+# reordered by how often they matched.
+_union_reorder_interval = 256
+
+
+class UnionChecker(TypeChecker):
+  """Allows values matching any of the alternatives, e.g. Union[int, str].
+
+  All classes among the alternatives are checked with a single isinstance
+  call. Other alternatives are tried in order of how often they matched
+  recently, so the most common one usually matches first. None allows None.
+  """
+  __slots__ = ("alternatives",)
+  _fields = __slots__
+
+  def __init__(self, *alternatives):
+    flattened = []
+    for alternative in alternatives:
+      if alternative is None:
+        alternative = type(None)
+      if isinstance(alternative, UnionChecker):
+        flattened.extend(alternative.alternatives)
+      else:
+        flattened.append(alternative)
+    self._Init(tuple(flattened))
+
+  def __reduce__(self):
+    return UnionChecker, self.alternatives
+
+  def Shallow(self):
+    return Union(*[_ShallowTypeCheck(alternative)
+                   for alternative in self.alternatives])
+
+  def ChecksTypesOnly(self):
+    return _ChecksTypesOnly(self.alternatives)
+
+  def Compile(self):
+    classes = tuple(alternative for alternative in self.alternatives
+                    if inspect.isclass(alternative))
+    entries = [[0, _CompileTypeCheck(alternative)]
+               for alternative in self.alternatives
+               if not inspect.isclass(alternative)]
+    if not entries:
+      return lambda value: isinstance(value, classes)
+
+    # Entries are [number of matches, predicate]. The list is replaced, not
+    # changed, when reordering, so concurrent calls can keep iterating.
+    order = [entries]
+    matches = [0]
+
+    def Reorder():
+      matches[0] = 0
+      ranked = sorted(order[0], key=lambda entry: -entry[0])
+      for entry in ranked:
+        entry[0] //= 2
+      order[0] = ranked
+
+    def ValidateUnion(value):
+      if classes and isinstance(value, classes):
+        return True
+      for entry in order[0]:
+        if entry[1](value):
+          entry[0] += 1
+          matches[0] += 1
+          if matches[0] >= _union_reorder_interval:
+            Reorder()
+          return True
+      return False
+    return ValidateUnion
+
+  def __repr__(self):
+    return "Union[%s]" % ", ".join(_FormatTypeCheck(alternative)
+                                   for alternative in self.alternatives)
+
+Union = TypeCheckerFactory(UnionChecker)
+
+
+class NotRequiredChecker(TypeChecker):
+  """Marks a key of a Record as optional. Otherwise checks like subtype."""
+  __slots__ = ("subtype",)
+  _fields = __slots__
+
+  def __init__(self, subtype):
+    self._Init(subtype)
+
+  def Compile(self):
+    return _CompileTypeCheck(self.subtype)
+
+  def Explain(self, value):
+    return "", value, self.subtype
+
+  def Shallow(self):
+    return NotRequired[_ShallowTypeCheck(self.subtype)]
+
+  def ChecksTypesOnly(self):
+    return _ChecksTypesOnly(self.subtype)
+
+  def __repr__(self):
+    return "NotRequired[%s]" % _FormatTypeCheck(self.subtype)
+
+NotRequired = TypeCheckerFactory(NotRequiredChecker)
+
+
+class _Missing(object):
+  """Value of a missing key in errors of Record checks."""
+  def __repr__(self):
+    return "<missing>"
+
+_missing = _Missing()
+
+
+class RecordChecker(TypeChecker):
+  """Allows only mappings with the given keys and types of their values.
+
+  Record["name": str, "tags": List[str], "parent": NotRequired[int]]
+
+  Keys are required unless their type is wrapped in NotRequired, other keys
+  are allowed. The fields can also be passed as a mapping,
+  Record({"name": str}). All keys are checked in a single pass.
+  """
+  __slots__ = ("fields",)
+  _fields = __slots__
+
+  def __init__(self, *fields):
+    if len(fields) == 1 and isinstance(fields[0], collections_abc.Mapping):
+      fields = [slice(key, type_check)
+                for key, type_check in fields[0].items()]
+    for field in fields:
+      if not isinstance(field, slice) or field.step is not None:
+        raise TypeError("Invalid Record field '%s'. Expected key: type" %
+                        repr(field))
+    self._Init(tuple((field.start, field.stop) for field in fields))
+
+  def __reduce__(self):
+    return RecordChecker, tuple(slice(key, type_check)
+                                for key, type_check in self.fields)
+
+  def Shallow(self):
+    return Dict()
+
+  def Compile(self):
+    # (key, class or None, predicate, required) of each field. Classes are
+    # checked with isinstance directly.
+    fields = []
+    for key, type_check in self.fields:
+      required = not isinstance(type_check, NotRequiredChecker)
+      if not required:
+        type_check = type_check.subtype
+      if inspect.isclass(type_check):
+        fields.append((key, type_check, None, required))
+      else:
+        fields.append((key, None, _CompileTypeCheck(type_check), required))
+    fields = tuple(fields)
+
+    def ValidateRecord(value):
+      if not _IsMapping(value):
+        return False
+      get = value.get
+      for key, value_class, predicate, required in fields:
+        item = get(key, _missing)
+        if item is _missing:
+          if required:
+            return False
+        elif value_class is not None:
+          if not isinstance(item, value_class):
+            return False
+        elif not predicate(item):
+          return False
+      return True
+    return ValidateRecord
+
+  def Explain(self, value):
+    if not _IsMapping(value):
+      return None
+    for key, type_check in self.fields:
+      path = "[%s]" % _short_repr.repr(key)
+      if key not in value:
+        if not isinstance(type_check, NotRequiredChecker):
+          return path, _missing, type_check
+      elif not _ValidateValue(value[key], type_check):
+        return path, value[key], type_check
+    return None
+
+  def __repr__(self):
+    fields = ["%r: %s" % (key, _FormatTypeCheck(type_check))
+              for key, type_check in self.fields]
+    return "Record[%s]" % ", ".join(fields)
+
+Record = TypeCheckerFactory(RecordChecker)
+
+
+class TypedAttribute(object):
+  """An attribute that is type checked when it is set, see Typed."""
+  def __init__(self, type_check):
+    self.type_check = type_check
+
+  def __set_name__(self, owner, name):
+    # Classes without TypecheckMeta, on Python 3.6+.
+    delattr(owner, name)
+    if _config.mode != "off":
+      _BindTypedAttributes(owner, {name: self})
+
+
+def _BindTypedAttributes(cls, typed_attributes):
+  """Installs a __setattr__ in cls checking the typed_attributes.
+
+  Checks of Typed attributes of parents are included. Other attributes are
+  passed to the __setattr__ the class would have had otherwise.
+  """
+  checks = dict(getattr(cls, "_typed_checks", {}))
+  for name, typed_attribute in typed_attributes.items():
+    type_check = typed_attribute.type_check
+    checks[name] = (type_check, _CompileTypeCheck(type_check))
+
+  for parent in cls.__mro__:
+    base_setattr = vars(parent).get("__setattr__")
+    if base_setattr is not None and not hasattr(base_setattr, "typed_checks"):
+      break
+  class_name = "%s.%s" % (cls.__module__, cls.__name__)
+
+  def __setattr__(self, name, value):
+    check = checks.get(name)
+    if check is not None and not check[1](value) and not _IsUnchecked():
+      if _config.mode == "report":
+        _violation_reporter.Record(class_name, name, check[0], type(value))
+      else:
+        raise TypecheckError([(name, check[0], value)], kind="attribute")
+    base_setattr(self, name, value)
+
+  __setattr__.typed_checks = checks
+  cls.__setattr__ = __setattr__
+  cls._typed_checks = checks
+
+Typed = TypeCheckerFactory(TypedAttribute)
+Typed.__doc__ = """Declares a class attribute that is type checked when set.
+
+class Point(object):
+  __metaclass__ = TypecheckMeta
+  __slots__ = ()
+  x = Typed[int]
+
+  def __init__(self, x):
+    self.x = x
+
+The attribute is read like a plain attribute, only setting it is checked
+by a __setattr__ added to the class. TypecheckMeta adds a slot for it to
+classes with __slots__. On Python 3.6+ Typed also works without
+TypecheckMeta, except in classes with __slots__.
+"""
+
+
+# Types of which all items are of the same type.
+_array_types = frozenset([array.array, bytearray, memoryview, bytes, str,
+                          type(u"")])
+
+
+def _ValidateArrayItems(value, item_class):
+  """Validates the items of arrays, buffers and strings by type.
+
+  Returns None if value is not one of these, so its items have to be
+  checked one by one.
+  """
+  if type(value) in _array_types:
+    try:
+      return len(value) == 0 or isinstance(value[0], item_class)
+    except (NotImplementedError, TypeError):
+      # Multi-dimensional memoryviews can not be indexed.
+      return None
+
+  numpy = sys.modules.get("numpy")
+  if numpy is not None and isinstance(value, numpy.ndarray):
+    if value.ndim == 0 or value.dtype.hasobject:
+      return None
+    if value.ndim > 1:
+      return len(value) == 0 or isinstance(value[0], item_class)
+    return issubclass(value.dtype.type, item_class)
+  return None
+
+
 def _ValidateTuple(value, type_check_tuple):
   if not isinstance(value, tuple):
     return False
+  if not _ChecksTypesOnly(type_check_tuple):
+    return _ValidateTupleItems(value, type_check_tuple)
+  return _validation_cache.Validate(
+      value, ("tuple", type_check_tuple),
+      lambda value: _ValidateTupleItems(value, type_check_tuple))
+
+def _ValidateTupleItems(value, type_check_tuple):
   if len(value) != len(type_check_tuple):
     return False
   for item, type_check in zip(value, type_check_tuple):
@@ -317,39 +1472,195 @@ def _ValidateValue(value, type_check):
 Dict = TypeCheckerFactory(DictChecker)
 
 
-def _ParseTypeCheckString(type_check_string, stack_location, self_name):
+_imap = getattr(itertools, "imap", map)
+
+
+def _IterValues(mapping):
+  itervalues = getattr(mapping, "itervalues", None)
+  return itervalues() if itervalues else mapping.values()
+
+
+def _CompileTypeCheck(type_check):
+  """Compiles type_check into a function validating a single value.
+
+  This does the same as _ValidateValue, but decides how to validate only
+  once instead of on every call and for every item of a container.
+  """
+  if inspect.isclass(type_check):
+    return lambda value: isinstance(value, type_check)
+  elif isinstance(type_check, tuple):
+    return _CompileTupleCheck(type_check)
+  elif isinstance(type_check, TypeChecker):
+    # Checkers are shared, e.g. by all functions using List[int].
+    predicate = getattr(type_check, "_predicate", None)
+    if predicate is None:
+      predicate = type_check.Compile()
+      object.__setattr__(type_check, "_predicate", predicate)
+    return predicate
+  elif callable(type_check):
+    return type_check
+  else:
+    raise TypeError("Invalid type check '%s'" % repr(type_check))
+
+
+def _ShallowTypeCheck(type_check):
+  """Returns type_check without checks of the items of containers."""
+  if isinstance(type_check, tuple):
+    return tuple
+  if isinstance(type_check, TypeChecker):
+    return type_check.Shallow()
+  return type_check
+
+
+def _ExplainTuple(value, type_check_tuple):
+  """Like TypeChecker.Explain for a tuple of type checks."""
+  if not isinstance(value, tuple) or len(value) != len(type_check_tuple):
+    return None
+  for index, (item, type_check) in enumerate(zip(value, type_check_tuple)):
+    if not _ValidateValue(item, type_check):
+      return "[%d]" % index, item, type_check
+  return None
+
+
+def _ExplainInvalidValue(value, type_check):
+  """Returns (path, value, type_check) of the innermost invalid part of value.
+
+  path is empty if no part of value is more specific than value itself.
+  """
+  path = ""
+  while True:
+    if isinstance(type_check, tuple):
+      explanation = _ExplainTuple(value, type_check)
+    elif isinstance(type_check, TypeChecker):
+      explanation = type_check.Explain(value)
+    else:
+      explanation = None
+    if explanation is None:
+      return path, value, type_check
+    item_path, value, type_check = explanation
+    path += item_path
+
+
+def _ChecksTypesOnly(type_check):
+  """Returns True if type_check only depends on the types of a value.
+
+  See TypeChecker.ChecksTypesOnly. Predicates may depend on anything.
+  """
+  if inspect.isclass(type_check):
+    return True
+  if isinstance(type_check, tuple):
+    return all(_ChecksTypesOnly(item_type) for item_type in type_check)
+  if isinstance(type_check, TypeChecker):
+    return type_check.ChecksTypesOnly()
+  return False
+
+
+def _CompileTupleCheck(type_check_tuple):
+  """Compiles a tuple of type checks matching the items of a tuple value."""
+  check_key = ("tuple", type_check_tuple)
+  length = len(type_check_tuple)
+  if all(inspect.isclass(item_type) for item_type in type_check_tuple):
+    def ValidateItems(value):
+      return (len(value) == length and
+              all(_imap(isinstance, value, type_check_tuple)))
+  else:
+    item_predicates = [_CompileTypeCheck(item_type)
+                       for item_type in type_check_tuple]
+    def ValidateItems(value):
+      if len(value) != length:
+        return False
+      for item, predicate in zip(value, item_predicates):
+        if not predicate(item):
+          return False
+      return True
+
+  if not _ChecksTypesOnly(type_check_tuple):
+    return lambda value: isinstance(value, tuple) and ValidateItems(value)
+
+  def ValidateTuple(value):
+    if not isinstance(value, tuple):
+      return False
+    return _validation_cache.Validate(value, check_key, ValidateItems)
+  return ValidateTuple
+
+
+def _CompileItemsCheck(item_type):
+  """Compiles a function checking all items of an iterable with item_type."""
+  if inspect.isclass(item_type):
+    repeated_type = itertools.repeat(item_type)
+    return lambda items: all(_imap(isinstance, items, repeated_type))
+
+  predicate = _CompileTypeCheck(item_type)
+  def ValidateItems(items):
+    for item in items:
+      if not predicate(item):
+        return False
+    return True
+  return ValidateItems
+
+
+# Maximum number of entries in _type_check_code and _parsed_type_checks.
+_max_parsed_type_checks = 4096
+
+# Compiled code of type check strings by string.
+_type_check_code = {}
+
+# Evaluated type check strings by (string, module name, self_name). Each
+# entry holds the objects the global names in the string were bound to, and
+# the evaluated type check. The globals themselves are not referenced, so
+# modules that are reloaded or executed again are not kept alive.
+_parsed_type_checks = {}
+
+
+def _ParseTypeCheckString(type_check_string, eval_globals, self_name):
   """Convert string version of a type_check into a python instance.
 
   Type checks can be either defined directly in python code or in a string.
   The syntax is exactly the same since we use eval to parse the string.
 
-  :param int stack_location: For eval to get the right globals() scope,
-    we require a stack_location to tell us the index in inspect.stack to
-    where the string was defined.
-  :param str self_name: Optional name of the class itself, which can be used
-    to type check for an instance of a class you are currently defining, and
-    thus would not be available in the globals namespace. If none, it will
-    be quessed from the stack.
-  """
-  target_frame = inspect.stack()[stack_location][0]
-  self_name = self_name or inspect.stack()[stack_location][3]
-  eval_globals = target_frame.f_globals
-  eval_locals = {self_name: Typename[self_name]}
+  The same string in the same module evaluates to the same type check
+  instance, as long as the global names it uses have not been rebound.
 
+  :param dict eval_globals: The globals() scope of where the string was
+    defined.
+  :param str self_name: Name of the class itself, which can be used to type
+    check for an instance of a class you are currently defining, and thus
+    would not be available in the globals namespace.
+  """
+  key = (type_check_string, eval_globals.get("__name__"), self_name)
+  entry = _parsed_type_checks.get(key)
+  if entry is not None:
+    bindings, type_check = entry
+    if all(eval_globals.get(name) is value for name, value in bindings):
+      return type_check
+
+  eval_locals = {self_name: Typename[self_name]}
   try:
-    return eval(type_check_string, eval_globals, eval_locals)
+    code = _type_check_code.get(type_check_string)
+    if code is None:
+      code = compile(type_check_string, "<type check>", "eval")
+      if len(_type_check_code) >= _max_parsed_type_checks:
+        _type_check_code.clear()
+      _type_check_code[type_check_string] = code
+    type_check = eval(code, eval_globals, eval_locals)
   except:
-    print "Exception while parsing", type_check_string
+    print("Exception while parsing", type_check_string)
     raise
 
+  bindings = tuple((name, eval_globals.get(name)) for name in code.co_names)
+  if len(_parsed_type_checks) >= _max_parsed_type_checks:
+    _parsed_type_checks.clear()
+  _parsed_type_checks[key] = (bindings, type_check)
+  return type_check
+
 
-def _ParseDocstring(function):
-  """Parses the functions docstring into a dictionary of type checks."""
-  if not function.__doc__:
+def _ParseDocstring(docstring):
+  """Parses a functions docstring into a dictionary of type check strings."""
+  if not docstring:
     return {}
 
   type_check_dict = {}
-  for match in param_regexp.finditer(function.__doc__):
+  for match in param_regexp.finditer(docstring):
     param_str = match.group(1).strip()
     param_splitted = param_str.split(" ")
     if len(param_splitted) >= 2:
@@ -357,14 +1668,14 @@ def _ParseDocstring(function):
       name = param_splitted[-1]
       type_check_dict[name] = type_str
 
-  for match in returns_regexp.finditer(function.__doc__):
+  for match in returns_regexp.finditer(docstring):
     type_check_dict["returns"] = match.group(1)
 
-  for match in type_regexp.finditer(function.__doc__):
+  for match in type_regexp.finditer(docstring):
     name = match.group(1)
     type_str = match.group(2)
     type_check_dict[name] = type_str
-  for match in rtype_regexp.finditer(function.__doc__):
+  for match in rtype_regexp.finditer(docstring):
     type_check_dict["returns"] = match.group(1)
   return type_check_dict
 
@@ -372,81 +1683,1049 @@ def _ParseDocstring(function):
 def _CollectArguments(function, args, kwargs):
   """Merges positional and keyword arguments into a single dict."""
   all_args = dict(kwargs)
-  arg_names = inspect.getargspec(function)[0]
+  arg_names = _GetArgNames(function)
   for position, arg in enumerate(args):
     if position < len(arg_names):
       all_args[arg_names[position]] = arg
   return all_args
 
 
-def _CollectTypeChecks(function, parent_type_check_dict, stack_location,
+# Types of annotations like list[int] (Python 3.9+) and int | None (3.10+).
+_GenericAliasTypes = tuple(getattr(types, name) for name in ("GenericAlias",)
+                           if hasattr(types, name))
+_UnionTypes = tuple(getattr(types, name) for name in ("UnionType",)
+                    if hasattr(types, name))
+
+
+def _AnnotationTypeCheck(annotation):
+  """Returns the type check for an annotation or None if it is not supported.
+
+  Classes, tuples, TypeChecker instances and strings are used as they are.
+  Unions like int | None are translated to Union, other generic aliases like
+  list[int] and constructs of the typing module are not supported.
+  """
+  if annotation is None:
+    return type(None)
+  if (isinstance(annotation, _GenericAliasTypes) or
+      getattr(annotation, "__module__", None) == "typing"):
+    return None
+  if isinstance(annotation, _UnionTypes):
+    alternatives = [_AnnotationTypeCheck(alternative)
+                    for alternative in annotation.__args__]
+    if None in alternatives:
+      return None
+    return Union(*alternatives)
+  if (inspect.isclass(annotation) or isinstance(annotation, tuple) or
+      isinstance(annotation, TypeChecker) or isinstance(annotation, str)):
+    return annotation
+  return None
+
+
+def _ParseAnnotations(function, eval_globals, self_name):
+  """Returns (type_check_dict, fully_annotated) of a function's annotations.
+
+  fully_annotated is True if the return value and every argument but self or
+  cls are annotated with a supported type check, see _AnnotationTypeCheck.
+  Unsupported annotations are ignored. An annotation of None only allows
+  None. String annotations, e.g. all of them with
+  "from __future__ import annotations", are evaluated first.
+  """
+  annotations = getattr(function, "__annotations__", None)
+  if not annotations:
+    return {}, False
+
+  type_check_dict = {}
+  for name, annotation in annotations.items():
+    if name == "return":
+      name = "returns"
+    type_check = _AnnotationTypeCheck(annotation)
+    if isinstance(type_check, str):
+      type_check = _ParseTypeCheckString(type_check, eval_globals, self_name)
+      type_check = (None if isinstance(type_check, str)
+                    else _AnnotationTypeCheck(type_check))
+    if type_check is not None:
+      type_check_dict[name] = type_check
+
+  arg_names = _GetArgNames(function)
+  if arg_names and arg_names[0] in ("self", "cls"):
+    arg_names = arg_names[1:]
+  fully_annotated = ("returns" in type_check_dict and
+                     all(name in type_check_dict for name in arg_names))
+  return type_check_dict, fully_annotated
+
+
+def _CollectTypeChecks(function, parent_type_check_dict, eval_globals,
                       self_name):
-  """Collect all type checks for this function."""
+  """Collect all type checks for this function.
+
+  Annotations take precedence over the docstring, which takes precedence
+  over the parent type checks. The docstring is not parsed if every argument
+  is annotated.
+  """
   type_check_dict = dict(parent_type_check_dict)
-  type_check_dict.update(_ParseDocstring(function))
+  annotations, fully_annotated = _ParseAnnotations(function, eval_globals,
+                                                   self_name)
+  if not fully_annotated:
+    type_check_dict.update(_ParseDocstring(function.__doc__))
+  type_check_dict.update(annotations)
 
   # Convert any potential string based checks into python instances.
   for key, value in type_check_dict.items():
     if isinstance(value, str):
-      type_check_dict[key] = _ParseTypeCheckString(value, stack_location + 1,
+      type_check_dict[key] = _ParseTypeCheckString(value, eval_globals,
                                                   self_name)
 
   return type_check_dict
 
 
-def _ValidateArguments(arg_dict, type_check_dict):
-  """Validate dictionary of arguments and return list of errors messages."""
-  messages = []
+_short_repr = reprlib.Repr()
+_short_repr.maxstring = 80
+_short_repr.maxother = 80
+
+
+def _FormatValue(value):
+  """Formats value for error messages, truncated to a bounded length.
+
+  Only the first few items of containers are visited.
+  """
+  if isinstance(value, (str, type(u""))):
+    if len(value) > _short_repr.maxstring:
+      return value[:_short_repr.maxstring - 3] + "..."
+    return value
+  return _short_repr.repr(value)
+
+
+class TypecheckError(TypeError):
+  """Raised for invalid arguments, return values and iterator items.
+
+  The message is only formatted when the error is converted to a string.
+  Values are truncated and the path to the innermost invalid item of a
+  container is included, e.g. b[1532]['key'].
+
+  :ivar list errors: (argument, type_check, value) of each invalid value.
+    argument is "returns" for return values.
+  :ivar bool items: If the values are items of an iterator argument or
+    return value.
+  :ivar str kind: "argument", or "attribute" for Typed attributes.
+  """
+  def __init__(self, errors, items=False, kind="argument"):
+    # Only the names are kept in args, which may be formatted eagerly, e.g.
+    # by repr() or logging.
+    TypeError.__init__(self, *[error[0] for error in errors])
+    self.errors = errors
+    self.items = items
+    self.kind = kind
+
+  def __reduce__(self):
+    return TypecheckError, (self.errors, self.items, self.kind)
+
+  def __repr__(self):
+    return "%s(%r)" % (type(self).__name__, str(self))
+
+  @property
+  def argument(self):
+    return self.errors[0][0]
+
+  @property
+  def type_check(self):
+    return self.errors[0][1]
+
+  @property
+  def value(self):
+    return self.errors[0][2]
+
+  def __str__(self):
+    return "\n".join(self._FormatError(*error) for error in self.errors)
+
+  def _FormatError(self, argument, type_check, value):
+    path, invalid_value, invalid_type_check = _ExplainInvalidValue(
+        value, type_check)
+    location = argument
+    if self.items:
+      description = "%s %s" % (self.kind, argument)
+      if argument == "returns":
+        description = "return value"
+      message = "Invalid item '%s' of %s" % (_FormatValue(invalid_value),
+                                             description)
+      location = "item"
+    elif argument == "returns":
+      message = "Invalid return value '%s'" % _FormatValue(invalid_value)
+    else:
+      message = "Invalid value '%s' for %s %s" % (
+          _FormatValue(invalid_value), self.kind, argument)
+    if path:
+      message += " at %s%s" % (location, path)
+    return "%s. Expected %s" % (message, _FormatTypeCheck(invalid_type_check))
+
+
+def _ValidateArguments(arg_dict, type_check_dict, invalid_name=None):
+  """Validate dictionary of arguments and return list of errors.
+
+  Each error is a tuple of (argument, type_check, value), see TypecheckError.
+  The argument invalid_name is known to be invalid and not validated again,
+  since sampled checks may pass on a second attempt.
+  """
+  errors = []
   for arg_name, arg_value in arg_dict.items():
     if arg_name in type_check_dict:
       type_check = type_check_dict[arg_name]
-      res = _ValidateValue(arg_value, type_check)
-      if not res:
-        message = ("Invalid value '%s' for argument %s. Expected %s" %
-                   (arg_value, arg_name, _FormatTypeCheck(type_check)))
-        messages.append(message)
-  return messages
+      if (arg_name == invalid_name or
+          not _ValidateValue(arg_value, type_check)):
+        errors.append((arg_name, type_check, arg_value))
+  return errors
+
+
+def _CompileItemCheck(type_check):
+  """Returns the function validating items of an iterator or None.
+
+  See TypeChecker.CompileItemCheck.
+  """
+  if isinstance(type_check, TypeChecker):
+    return type_check.CompileItemCheck()
+  return None
+
+
+def _CompileArgumentChecks(function, type_check_dict):
+  """Maps each checked argument to its slot in the function signature.
+
+  Returns two tuples of (position, name, predicate) entries. The first
+  has one entry for each argument that has a type check, the second one
+  for each argument that is streamed (see TypeChecker.CompileItemCheck).
+  Streamed arguments are not validated by the predicate if they are
+  iterators, the predicate in the second tuple validates their items.
+
+  position is None for arguments that can only be passed by keyword.
+  Arguments without a type check are left out, so the wrapper does not have
+  to look at them at all.
+  """
+  arg_names = _GetArgNames(function)
+  slots = [(position, name) for position, name in enumerate(arg_names)
+           if name in type_check_dict]
+  slots.extend((None, name) for name in type_check_dict
+               if name not in arg_names and name != "returns")
 
+  argument_checks = []
+  streamed_arguments = []
+  for position, name in slots:
+    predicate = _CompileTypeCheck(type_check_dict[name])
+    item_check = _CompileItemCheck(type_check_dict[name])
+    if item_check:
+      predicate = _SkipIterators(predicate)
+      streamed_arguments.append((position, name, item_check))
+    argument_checks.append((position, name, predicate))
+  return tuple(argument_checks), tuple(streamed_arguments)
 
-def _ValidateReturnValue(return_value, type_check_dict):
-  """Validate return value and return list of errors messages."""
-  return_check = type_check_dict.get("returns", None)
-  if not return_check:
-    return []
 
-  messages = []
-  if not _ValidateValue(return_value, return_check):
-    message = ("Invalid return value '%s'. Expected %s" %
-               (return_value, _FormatTypeCheck(return_check)))
-    messages.append(message)
-  return messages
+def _SkipIterators(predicate):
+  return lambda value: _IsIterator(value) or predicate(value)
 
 
-def _TypecheckFunction(function, parent_type_check_dict, stack_location,
+class _ItemValidator(object):
+  """Base class for wrappers validating the items of an iterator.
+
+  Other attributes are forwarded to the iterator, so e.g. files keep their
+  methods.
+
+  :param type_checks: The _TypeChecks of the function the iterator was
+    passed to or returned from.
+  :param str name: Name of the argument or "returns".
+  """
+  def __init__(self, iterator, item_check, type_checks, name):
+    self._iterator = iterator
+    self._item_check = item_check
+    self._type_checks = type_checks
+    self._name = name
+
+  def __getattr__(self, name):
+    # Only called for attributes the wrapper lacks, e.g. readline of files.
+    if "_iterator" not in self.__dict__:
+      raise AttributeError(name)
+    return getattr(self._iterator, name)
+
+  def _Check(self, item):
+    if not self._item_check(item):
+      self._type_checks.InvalidItem(self._name, item)
+    return item
+
+
+class _CheckedIterator(_ItemValidator):
+  """Wraps an iterator to validate each item when it is pulled.
+
+  Forwards send, throw and close to wrapped generators.
+  """
+  def __iter__(self):
+    return self
+
+  def next(self):
+    return self._Check(next(self._iterator))
+
+  __next__ = next
+
+  def send(self, value):
+    return self._Check(self._iterator.send(value))
+
+  def throw(self, *args):
+    return self._Check(self._iterator.throw(*args))
+
+  def close(self):
+    return self._iterator.close()
+
+
+class _CheckedAwaitable(object):
+  """Wraps an awaitable to validate its result with check when awaited.
+
+  check returns the result or raises TypeError. This is a coroutine, so it
+  can be awaited, passed to asyncio.run or scheduled as a task just like
+  the awaitable it wraps, without any additional tasks or event loop
+  iterations.
+  """
+  def __init__(self, awaitable, check):
+    self.awaitable = awaitable
+    self.iterator = None
+    self.check = check
+
+  def __await__(self):
+    return self
+
+  def __iter__(self):
+    return self
+
+  def _Iterator(self):
+    if self.iterator is None:
+      self.iterator = self.awaitable.__await__()
+    return self.iterator
+
+  def __next__(self):
+    return self.send(None)
+
+  def send(self, value):
+    try:
+      return self._Iterator().send(value)
+    except StopIteration as stop:
+      raise StopIteration(self.check(stop.value))
+
+  def throw(self, *args):
+    try:
+      return self._Iterator().throw(*args)
+    except StopIteration as stop:
+      raise StopIteration(self.check(stop.value))
+
+  def close(self):
+    if self.iterator is None:
+      return self.awaitable.close()
+    return self.iterator.close()
+
+
+class _CheckedAsyncIterator(_ItemValidator):
+  """Wraps an async iterator to validate each item when it is awaited.
+
+  Forwards asend, athrow and aclose to wrapped async generators.
+  """
+  def __aiter__(self):
+    return self
+
+  def __anext__(self):
+    return _CheckedAwaitable(self._iterator.__anext__(), self._Check)
+
+  def asend(self, value):
+    return _CheckedAwaitable(self._iterator.asend(value), self._Check)
+
+  def athrow(self, *args):
+    return _CheckedAwaitable(self._iterator.athrow(*args), self._Check)
+
+  def aclose(self):
+    return self._iterator.aclose()
+
+
+def _IsCoroutineFunction(function):
+  return (hasattr(inspect, "iscoroutinefunction") and
+          inspect.iscoroutinefunction(function))
+
+
+def _IsAsyncGeneratorFunction(function):
+  return (hasattr(inspect, "isasyncgenfunction") and
+          inspect.isasyncgenfunction(function))
+
+
+def _MarkCoroutineFunction(function):
+  """Makes inspect and asyncio recognize function as coroutine function."""
+  if hasattr(inspect, "markcoroutinefunction"):
+    inspect.markcoroutinefunction(function)
+    return
+  asyncio_coroutines = sys.modules.get("asyncio.coroutines")
+  if hasattr(asyncio_coroutines, "_is_coroutine"):
+    function._is_coroutine = asyncio_coroutines._is_coroutine
+
+
+def _StreamArguments(type_checks, args, kwargs):
+  """Returns args and kwargs with iterators replaced by _CheckedIterator."""
+  args = list(args)
+  for position, name, item_check in type_checks.streamed_arguments:
+    if position is not None and position < len(args):
+      value = args[position]
+    elif name in kwargs:
+      value = kwargs[name]
+    else:
+      continue
+    if not _IsIterator(value):
+      continue
+    value = _CheckedIterator(value, item_check, type_checks, name)
+    if position is not None and position < len(args):
+      args[position] = value
+    else:
+      kwargs[name] = value
+  return args, kwargs
+
+
+def _RaiseArgumentErrors(function, args, kwargs, type_check_dict, name):
+  """Raises TypecheckError for all invalid arguments, including name."""
+  arg_dict = _CollectArguments(function, args, kwargs)
+  raise TypecheckError(_ValidateArguments(arg_dict, type_check_dict, name))
+
+
+class Violation(collections.namedtuple(
+    "Violation", "function argument expected value_type count")):
+  """A type check violation recorded in report mode.
+
+  argument is "returns" for return values. count is the number of times the
+  violation occurred since it was last reported.
+  """
+  __slots__ = ()
+
+  def __str__(self):
+    return ("Invalid value of type %s for %s of %s (%d times). Expected %s" %
+            (self.value_type.__name__,
+             "return value" if self.argument == "returns"
+             else "argument %s" % self.argument,
+             self.function, self.count, _FormatTypeCheck(self.expected)))
+
+
+class LoggingSink(object):
+  """Report sink that logs each Violation."""
+  def __init__(self, logger=None, level=logging.WARNING):
+    self.logger = logger or _logger
+    self.level = level
+
+  def __call__(self, violation):
+    self.logger.log(self.level, "%s", violation)
+
+
+class FileSink(object):
+  """Report sink that appends each Violation as a line to a file."""
+  def __init__(self, path):
+    self.path = path
+
+  def __call__(self, violation):
+    with open(self.path, "a") as report_file:
+      report_file.write("%s\n" % (violation,))
+
+
+class _ViolationReporter(object):
+  """Passes violations recorded in report mode to the report_sink.
+
+  Record() only appends to a bounded deque, which is thread safe without
+  locks and drops the oldest records once full. A background thread
+  deduplicates the records, limits how often the same violation is reported
+  and does all formatting and I/O in the sink.
+
+  A forked child process, e.g. a multiprocessing worker, starts its own
+  thread and reports what it buffered when the worker exits.
+  """
+  flush_interval = 1.0
+
+  def __init__(self, buffer_size):
+    self.buffer = collections.deque(maxlen=buffer_size)
+    self.thread = None
+    # Process owning the state, and whether it was forked from another one.
+    self.pid = os.getpid()
+    self.forked = False
+    self.start_lock = threading.Lock()
+    self.flush_lock = threading.Lock()
+    # Time of the last report and number of suppressed records since then,
+    # by record.
+    self.last_reported = {}
+    self.suppressed = {}
+
+  def Record(self, function_name, argument, expected, value_type):
+    if self.pid != os.getpid():
+      # Forked on Python versions without os.register_at_fork.
+      self.AfterFork()
+    self.buffer.append((function_name, argument, expected, value_type))
+    if self.thread is None:
+      self.Start()
+
+  def Start(self):
+    with self.start_lock:
+      if self.thread is not None:
+        return
+      thread = threading.Thread(target=self.Run, name="safetynet reporter")
+      thread.daemon = True
+      thread.start()
+      if not self.forked:
+        atexit.register(self.Flush)
+      else:
+        # Worker processes exit without running atexit handlers, but run
+        # the finalizers of multiprocessing.
+        multiprocessing_util = sys.modules.get("multiprocessing.util")
+        if multiprocessing_util is not None:
+          multiprocessing_util.Finalize(None, self.Flush, exitpriority=0)
+      self.thread = thread
+
+  def AfterFork(self):
+    """Resets the state inherited by a forked child process.
+
+    The reporter thread does not exist in the child and may have held the
+    locks. Records buffered and reported by the parent are its own.
+    """
+    self.pid = os.getpid()
+    self.forked = True
+    self.thread = None
+    self.start_lock = threading.Lock()
+    self.flush_lock = threading.Lock()
+    self.buffer.clear()
+    self.last_reported = {}
+    self.suppressed = {}
+
+  def Run(self):
+    while True:
+      time.sleep(self.flush_interval)
+      self.Flush()
+
+  def Resize(self, buffer_size):
+    self.buffer = collections.deque(self.buffer, maxlen=buffer_size)
+
+  def Flush(self):
+    """Reports all buffered violations."""
+    with self.flush_lock:
+      counts = collections.OrderedDict()
+      while True:
+        try:
+          record = self.buffer.popleft()
+        except IndexError:
+          break
+        key = _ViolationKey(record)
+        if key in counts:
+          counts[key][1] += 1
+        else:
+          counts[key] = [record, 1]
+      for key in list(self.suppressed):
+        if key not in counts:
+          counts[key] = [self.suppressed[key][0], 0]
+
+      now = time.time()
+      sink = _config.report_sink or _default_sink
+      for key, (record, count) in counts.items():
+        count += self.suppressed.pop(key, (None, 0))[1]
+        last_reported = self.last_reported.get(key)
+        if (last_reported is not None and
+            now - last_reported < _config.report_interval):
+          self.suppressed[key] = (record, count)
+          continue
+        self.last_reported[key] = now
+        try:
+          sink(Violation(*(record + (count,))))
+        except Exception:
+          _logger.exception("Report sink failed")
+
+
+def _ViolationKey(record):
+  try:
+    hash(record)
+    return record
+  except TypeError:
+    # Custom type checks may not be hashable.
+    function_name, argument, expected, value_type = record
+    return (function_name, argument, id(expected), value_type)
+
+
+_logger = logging.getLogger("safetynet")
+_default_sink = LoggingSink()
+_violation_reporter = _ViolationReporter(_config.report_buffer_size)
+if hasattr(os, "register_at_fork"):
+  os.register_at_fork(after_in_child=_violation_reporter.AfterFork)
+
+
+def flush_violations():
+  """Reports all violations buffered in report mode right away."""
+  _violation_reporter.Flush()
+
+
+class FunctionStats(object):
+  """Number of calls and time spent in type checks of a single function.
+
+  Times are in seconds and only contain the time spent checking arguments
+  and return values, not the time spent in the function itself.
+  """
+  def __init__(self, name):
+    self.name = name
+    self.calls = 0
+    self.failures = 0
+    self.argument_time = 0.0
+    self.max_argument_time = 0.0
+    self.return_time = 0.0
+    self.max_return_time = 0.0
+
+  @property
+  def total_time(self):
+    return self.argument_time + self.return_time
+
+  def AddArgumentTime(self, duration):
+    self.argument_time += duration
+    if duration > self.max_argument_time:
+      self.max_argument_time = duration
+
+  def AddReturnTime(self, duration):
+    self.return_time += duration
+    if duration > self.max_return_time:
+      self.max_return_time = duration
+
+  def __repr__(self):
+    return ("FunctionStats(%s, calls=%d, failures=%d, total_time=%f)" %
+            (self.name, self.calls, self.failures, self.total_time))
+
+
+# All _TypeChecks that recorded FunctionStats.
+_function_stats = weakref.WeakSet()
+_clock = getattr(time, "perf_counter", time.time)
+
+
+def stats():
+  """Returns FunctionStats of all functions called with stats enabled.
+
+  Sorted by the total time spent in type checks, most expensive first.
+  Statistics are only recorded with configure(stats=True).
+  """
+  all_stats = [type_checks.stats for type_checks in list(_function_stats)]
+  return sorted(all_stats, key=lambda stats: stats.total_time, reverse=True)
+
+
+def stats_report(limit=None):
+  """Returns stats() formatted as a table.
+
+  :param int limit: Maximum number of functions to list.
+  """
+  lines = ["%8s %8s %10s %10s %10s %10s %10s  %s" %
+           ("calls", "failures", "total ms", "args ms", "max args",
+            "return ms", "max return", "function")]
+  for function_stats in stats()[:limit]:
+    lines.append("%8d %8d %10.3f %10.3f %10.3f %10.3f %10.3f  %s" % (
+        function_stats.calls, function_stats.failures,
+        function_stats.total_time * 1000,
+        function_stats.argument_time * 1000,
+        function_stats.max_argument_time * 1000,
+        function_stats.return_time * 1000,
+        function_stats.max_return_time * 1000,
+        function_stats.name))
+  return "\n".join(lines)
+
+
+def reset_stats():
+  """Discards all recorded statistics."""
+  for type_checks in list(_function_stats):
+    type_checks.stats = None
+  _function_stats.clear()
+
+
+# Serializes _TypeChecks.Resolve. Reentrant, since resolving a method resolves
+# the methods it overrides first.
+_resolve_lock = threading.RLock()
+
+
+class _TypeChecks(object):
+  """The type checks of a single function.
+
+  Collects the type checks from the parent, decorator and docstring and
+  compiles them once Resolve() is called, which happens either at the time
+  of definition or with configure(lazy=True) on first use.
+  """
+  def __init__(self, function, name, parent_type_checks, eval_globals,
+               self_name):
+    """
+    :param str name: Name of the function used in reports.
+    :param parent_type_checks: Either a dict of type checks or the
+      _TypeChecks of the parent function to inherit type checks from.
+    """
+    self.function = function
+    self.name = name
+    self.stats = None
+    self.parent_type_checks = parent_type_checks
+    self.eval_globals = eval_globals
+    self.self_name = self_name
+    self.resolved = False
+    self.type_check_dict = None
+    self.argument_checks = ()
+    self.streamed_arguments = ()
+    self.return_check = None
+    self.return_item_check = None
+    # Whether return values can not be checked by return_check alone.
+    self.wrap_return_value = False
+    self.is_coroutine_function = _IsCoroutineFunction(function)
+    self.is_async_generator_function = _IsAsyncGeneratorFunction(function)
+    # The _OverheadBudget, once configure(overhead_budget=...) is used.
+    self.budget = None
+
+  def Resolve(self):
+    """Collects and compiles all type checks. Returns self.
+
+    Threads calling a lazily checked function for the first time at once
+    wait for the first one to resolve it.
+    """
+    if self.resolved:
+      return self
+    with _resolve_lock:
+      if self.resolved:
+        return self
+      parent_type_check_dict = self.parent_type_checks
+      if isinstance(parent_type_check_dict, _TypeChecks):
+        parent_type_check_dict = (
+            parent_type_check_dict.Resolve().type_check_dict)
+      type_check_dict = _CollectTypeChecks(
+          self.function, parent_type_check_dict, self.eval_globals,
+          self.self_name)
+      self.eval_globals = None
+      self.Compile(type_check_dict)
+    return self
+
+  def Compile(self, type_check_dict):
+    """Compiles the collected type checks."""
+    self.argument_checks, self.streamed_arguments = _CompileArgumentChecks(
+        self.function, type_check_dict)
+    return_type_check = type_check_dict.get("returns", None)
+    if return_type_check:
+      self.return_check = _CompileTypeCheck(return_type_check)
+      self.return_item_check = _CompileItemCheck(return_type_check)
+      self.wrap_return_value = bool(self.return_item_check or
+                                    self.is_coroutine_function)
+    self.type_check_dict = type_check_dict
+    self.resolved = True
+
+  def Shallow(self):
+    """Returns new _TypeChecks not visiting the items of containers."""
+    shallow = _TypeChecks(self.function, self.name, {}, None, self.self_name)
+    shallow.Compile(dict((name, _ShallowTypeCheck(type_check))
+                         for name, type_check in self.type_check_dict.items()))
+    return shallow
+
+  def CheckArguments(self, args, kwargs):
+    """Raises TypeError if any of the arguments is invalid."""
+    num_args = len(args)
+    for position, name, predicate in self.argument_checks:
+      if position is not None and position < num_args:
+        value = args[position]
+      elif name in kwargs:
+        value = kwargs[name]
+      else:
+        continue
+      if not predicate(value):
+        self.InvalidArgument(args, kwargs, name, value)
+
+  def CheckReturnValue(self, return_value):
+    """Returns the return_value or raises TypeError if it is invalid.
+
+    Coroutines are wrapped to check their result once awaited. Iterators and
+    async iterators are wrapped to check each item instead.
+    """
+    if self.return_check is None:
+      return return_value
+    if self.is_coroutine_function:
+      return _CheckedAwaitable(return_value, self.CheckResult)
+    if self.is_async_generator_function and self.return_item_check:
+      return _CheckedAsyncIterator(return_value, self.return_item_check, self,
+                                   "returns")
+    return self.CheckResult(return_value)
+
+  def CheckResult(self, return_value):
+    """Same as CheckReturnValue, but for the result of a coroutine."""
+    if self.return_item_check and _IsIterator(return_value):
+      return _CheckedIterator(return_value, self.return_item_check, self,
+                              "returns")
+    return_check = self.return_check
+    if return_check and not return_check(return_value):
+      self.InvalidReturnValue(return_value)
+    return return_value
+
+  def _Report(self, name, value):
+    if self.stats is not None:
+      self.stats.failures += 1
+    _violation_reporter.Record(self.name, name, self.type_check_dict[name],
+                               type(value))
+
+  def InvalidArgument(self, args, kwargs, name, value):
+    """Raises TypeError, or reports the argument in report mode."""
+    if _config.mode == "report":
+      self._Report(name, value)
+    else:
+      _RaiseArgumentErrors(self.function, args, kwargs, self.type_check_dict,
+                           name)
+
+  def InvalidReturnValue(self, return_value):
+    """Raises TypeError, or reports the return value in report mode."""
+    if _config.mode == "report":
+      self._Report("returns", return_value)
+    else:
+      raise TypecheckError([("returns", self.type_check_dict["returns"],
+                             return_value)])
+
+  def InvalidItem(self, name, item):
+    """Raises TypeError, or reports the iterator item in report mode."""
+    if _config.mode == "report":
+      self._Report(name, item)
+      return
+    item_type = self.type_check_dict[name].item_type
+    raise TypecheckError([(name, item_type, item)], items=True)
+
+  def Call(self, args, kwargs):
+    """Calls the function with arguments and return value checked."""
+    if not self.resolved:
+      self.Resolve()
+    if _config.stats:
+      return self.CallWithStats(args, kwargs)
+    if _config.overhead_budget:
+      budget = self.budget
+      if budget is None:
+        budget = self.budget = _OverheadBudget(self)
+      return budget.Call(args, kwargs)
+    return self.CheckedCall(args, kwargs)
+
+  def CheckedCall(self, args, kwargs):
+    """Same as Call, for resolved type checks without stats."""
+    self.CheckArguments(args, kwargs)
+    if self.streamed_arguments:
+      args, kwargs = _StreamArguments(self, args, kwargs)
+    return self.CheckReturnValue(self.function(*args, **kwargs))
+
+  def CallWithStats(self, args, kwargs):
+    """Same as Call, but records the time spent in checks. See stats()."""
+    if not self.resolved:
+      self.Resolve()
+    stats = self.stats
+    if stats is None:
+      stats = self.stats = FunctionStats(self.name)
+      _function_stats.add(self)
+
+    stats.calls += 1
+    start = _clock()
+    try:
+      self.CheckArguments(args, kwargs)
+      if self.streamed_arguments:
+        args, kwargs = _StreamArguments(self, args, kwargs)
+    except TypeError:
+      stats.failures += 1
+      raise
+    finally:
+      stats.AddArgumentTime(_clock() - start)
+
+    return_value = self.function(*args, **kwargs)
+
+    start = _clock()
+    try:
+      return self.CheckReturnValue(return_value)
+    except TypeError:
+      stats.failures += 1
+      raise
+    finally:
+      stats.AddReturnTime(_clock() - start)
+
+
+class _OverheadBudget(object):
+  """Adapts how thoroughly a function is checked to the overhead_budget.
+
+  On every measure_interval-th call, the time spent in checks and in the
+  function itself are measured. After measure_window measurements, checks
+  are reduced by one level if they took more than overhead_budget times as
+  long as the function: From full checks, to shallow checks that do not
+  visit the items of containers, to shallow checks on one in sample_interval
+  calls. After retry_calls calls on a reduced level, the next higher level
+  is tried again.
+  """
+  levels = ("full", "shallow", "sampled")
+  measure_interval = 16
+  measure_window = 32
+  sample_interval = 64
+  retry_calls = 100000
+
+  def __init__(self, type_checks):
+    self.type_checks = type_checks
+    self.shallow_type_checks = None
+    self.level = 0
+    self.checks = type_checks
+    self.Reset()
+
+  def Reset(self):
+    self.calls = 0
+    self.measurements = 0
+    self.check_time = 0.0
+    self.function_time = 0.0
+
+  def Call(self, args, kwargs):
+    self.calls += 1
+    calls = self.calls
+    if self.level and calls >= self.retry_calls:
+      self.SetLevel(self.level - 1, "retrying after %d calls" % calls)
+    checks = self.checks
+    if self.level == 2:
+      if calls % self.sample_interval:
+        return checks.function(*args, **kwargs)
+      return checks.CheckedCall(args, kwargs)
+    if calls % self.measure_interval:
+      return checks.CheckedCall(args, kwargs)
+
+    start = _clock()
+    checks.CheckArguments(args, kwargs)
+    if checks.streamed_arguments:
+      args, kwargs = _StreamArguments(checks, args, kwargs)
+    function_start = _clock()
+    return_value = checks.function(*args, **kwargs)
+    function_end = _clock()
+    return_value = checks.CheckReturnValue(return_value)
+    self.AddMeasurement((function_start - start) + (_clock() - function_end),
+                        function_end - function_start)
+    return return_value
+
+  def AddMeasurement(self, check_time, function_time):
+    self.check_time += check_time
+    self.function_time += function_time
+    self.measurements += 1
+    if self.measurements < self.measure_window:
+      return
+    ratio = self.check_time / max(self.function_time, 1e-9)
+    if self.level < 2 and ratio > _config.overhead_budget:
+      self.SetLevel(self.level + 1, "checks took %.1f times as long as the "
+                    "function" % ratio)
+    else:
+      self.measurements = 0
+      self.check_time = 0.0
+      self.function_time = 0.0
+
+  def SetLevel(self, level, reason):
+    _logger.info("Using %s type checks for %s: %s", self.levels[level],
+                 self.type_checks.name, reason)
+    if level > 0 and self.shallow_type_checks is None:
+      self.shallow_type_checks = self.type_checks.Shallow()
+    self.checks = self.shallow_type_checks if level else self.type_checks
+    self.level = level
+    self.Reset()
+
+
+if contextvars is not None:
+  _unchecked_state = contextvars.ContextVar("safetynet_unchecked",
+                                            default=False)
+  _IsUnchecked = _unchecked_state.get
+else:
+  _unchecked_state = threading.local()
+
+  def _IsUnchecked():
+    return getattr(_unchecked_state, "active", False)
+
+
+class _Unchecked(object):
+  """Context manager and decorator returned by unchecked()."""
+  def __enter__(self):
+    if contextvars is not None:
+      self.token = _unchecked_state.set(True)
+    else:
+      self.previous = _IsUnchecked()
+      _unchecked_state.active = True
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if contextvars is not None:
+      _unchecked_state.reset(self.token)
+    else:
+      _unchecked_state.active = self.previous
+
+  def __call__(self, function):
+    @functools.wraps(function)
+    def UncheckedWrapper(*args, **kwargs):
+      with _Unchecked():
+        return function(*args, **kwargs)
+    return UncheckedWrapper
+
+
+def unchecked(function=None):
+  """Disables type checks of calls in the current thread or task.
+
+  Use it for code passing values that have already been validated:
+
+  with safetynet.unchecked():
+    ...
+
+  As a decorator, checks are disabled during each call of the function:
+
+  @safetynet.unchecked
+  def InnerLoop(items):
+    ...
+
+  Other threads, and asyncio tasks on Python 3.7+, are still checked.
+  Generators and coroutines are only unchecked while they are created, not
+  while they run.
+  """
+  if function is None:
+    return _Unchecked()
+  return _Unchecked()(function)
+
+
+def _TypecheckFunction(function, parent_type_checks, stack_location,
                       self_name):
-  """Decorator function to collect and execute type checks."""
-  type_check_dict = _CollectTypeChecks(function, parent_type_check_dict,
-                                      stack_location + 1, self_name)
-  if not type_check_dict:
+  """Decorator function to collect and execute type checks.
+
+  The signature of the function is only inspected and the type checks are
+  only compiled once. The wrapper looks up each checked argument directly by
+  its position or keyword and only falls back to collecting all arguments to
+  build the error messages once a check has failed.
+
+  :param int stack_location: Index of the frame in which function was
+    defined, relative to this one. Type check strings are evaluated in its
+    globals() scope.
+  :param str self_name: Optional name of the class that is being defined.
+    If None, it is taken from the frame at stack_location.
+  """
+  name = "%s.%s" % (function.__module__, function.__name__)
+  if self_name:
+    name = "%s.%s.%s" % (function.__module__, self_name, function.__name__)
+  frame = sys._getframe(stack_location)
+  type_checks = _TypeChecks(function, name, parent_type_checks,
+                            frame.f_globals, self_name or frame.f_code.co_name)
+  del frame
+  if not _config.lazy and not type_checks.Resolve().type_check_dict:
     return function
 
   def TypecheckWrapper(*args, **kwargs):
-    arg_dict = _CollectArguments(function, args, kwargs)
-    errors = _ValidateArguments(arg_dict, type_check_dict)
-    if errors:
-      raise TypeError("\n".join(errors))
+    if _IsUnchecked():
+      return function(*args, **kwargs)
+    if _config._instrumented or not type_checks.resolved:
+      return type_checks.Call(args, kwargs)
+
+    # Same as _TypeChecks.Call, inlined since it is the hot path.
+    num_args = len(args)
+    for position, name, predicate in type_checks.argument_checks:
+      if position is not None and position < num_args:
+        value = args[position]
+      elif name in kwargs:
+        value = kwargs[name]
+      else:
+        continue
+      if not predicate(value):
+        type_checks.InvalidArgument(args, kwargs, name, value)
+    if type_checks.streamed_arguments:
+      args, kwargs = _StreamArguments(type_checks, args, kwargs)
 
     return_value = function(*args, **kwargs)
 
-    errors = _ValidateReturnValue(return_value, type_check_dict)
-    if errors:
-      raise TypeError("\n".join(errors))
+    return_check = type_checks.return_check
+    if type_checks.wrap_return_value or (return_check and
+                                         not return_check(return_value)):
+      return type_checks.CheckReturnValue(return_value)
     return return_value
 
-  TypecheckWrapper.__doc__ = function.__doc__
-  TypecheckWrapper.__name__ = function.__name__
-  TypecheckWrapper.type_check_dict = type_check_dict
+  # Wrappers take the __module__ and __qualname__ of the function, so they are
+  # pickled by reference, e.g. when passed to a multiprocessing pool.
+  functools.update_wrapper(TypecheckWrapper, function)
+  TypecheckWrapper.__wrapped__ = function
+  TypecheckWrapper.type_checks = type_checks
   TypecheckWrapper.wrapped_function = function
+  if type_checks.is_coroutine_function:
+    _MarkCoroutineFunction(TypecheckWrapper)
 
   return TypecheckWrapper
 
@@ -462,7 +2741,9 @@ def _TypecheckDecorator(subject=None, **kwargs):
   Functions or methods are annotated directly. If this method is called
   with keyword arguments only, return a decorator.
   """
-  if subject is None:
+  if _config.mode == "off":
+    return subject or (lambda function: function)
+  elif subject is None:
     return _TypecheckDecoratorFactory(kwargs)
   elif inspect.isfunction(subject) or inspect.ismethod(subject):
     return _TypecheckFunction(subject, {}, 2, None)
@@ -487,4 +2768,4 @@ Or in sphinx formatted docstrings:
 
 For classes you can use the TypecheckMeta meta-class instead. For additional
 options to check besides type, have a look at Iterable, Mapping or Optional.
-"""
\ No newline at end of file
+"""
@@ -0,0 +1,217 @@
+"""Benchmarks measuring the overhead of safetynet type checks.
+
+Run with:
+  python safetynet_benchmarks.py --output results.json
+
+Results are written as JSON. Pass a previous result file with --compare to
+print how much each benchmark changed, e.g. between two versions.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+from safetynet import (Dict, InterfaceMeta, List, Optional, Tuple,
+                       TypecheckMeta, typecheck)
+
+
+DEFAULT_SIZES = [10, 1000, 100000, 1000000]
+
+
+def Measure(function, min_time, repeat):
+  """Returns the fastest time of a single call to function in seconds.
+
+  The number of calls per measurement is increased until they take at least
+  min_time seconds in total.
+  """
+  timer = timeit.Timer(function)
+  number = 1
+  while True:
+    duration = timer.timeit(number)
+    if duration >= min_time:
+      break
+    number *= 10
+  durations = [duration] + timer.repeat(repeat - 1, number)
+  return min(durations) / number
+
+
+def Undecorated(a, b, c):
+  return a
+
+
+@typecheck(a=int, b=str, c=Optional[float], returns=int)
+def DecoratorStyle(a, b, c):
+  return a
+
+
+@typecheck
+def DocstringStyle(a, b, c):
+  """
+  :type a: int
+  :type b: str
+  :type c: Optional[float]
+  :rtype: int
+  """
+  return a
+
+
+def CallBenchmarks():
+  """Yields (name, size, function) to measure the cost of a call."""
+  yield "call.undecorated", None, lambda: Undecorated(1, "b", None)
+  yield "call.decorator", None, lambda: DecoratorStyle(1, "b", None)
+  yield "call.docstring", None, lambda: DocstringStyle(1, "b", None)
+
+
+def ContainerBenchmarks(sizes):
+  """Yields (name, size, function) to measure the cost of container checks."""
+  for size in sizes:
+    items = list(range(size))
+    mapping = dict((str(i), i) for i in range(size))
+    item_tuple = tuple(items)
+
+    @typecheck(a=List[int])
+    def CheckList(a):
+      pass
+
+    @typecheck(a=Dict[str, int])
+    def CheckDict(a):
+      pass
+
+    @typecheck(a=Tuple[(int,) * size])
+    def CheckTuple(a):
+      pass
+
+    @typecheck(a=Optional[List[int]])
+    def CheckOptional(a):
+      pass
+
+    yield "check.list", size, lambda: CheckList(items)
+    yield "check.dict", size, lambda: CheckDict(mapping)
+    yield "check.tuple", size, lambda: CheckTuple(item_tuple)
+    yield "check.optional", size, lambda: CheckOptional(items)
+
+
+def _ClassMembers(num_methods):
+  members = {}
+  for i in range(num_methods):
+    def Method(self, a, b):
+      """
+      :type a: int
+      :type b: List[str]
+      :rtype: Optional[int]
+      """
+    Method.__name__ = "method_%d" % i
+    members[Method.__name__] = Method
+  return members
+
+
+def ClassBenchmarks(num_methods):
+  """Yields (name, size, function) to measure the cost of defining classes."""
+  def DefineClass(metaclass):
+    metaclass("Example", (object,), _ClassMembers(num_methods))
+
+  yield "class.plain", num_methods, lambda: DefineClass(type)
+  yield ("class.typecheck_meta", num_methods,
+         lambda: DefineClass(TypecheckMeta))
+  yield ("class.interface_meta", num_methods,
+         lambda: DefineClass(InterfaceMeta))
+
+
+MODULE_FUNCTION = '''
+@typecheck
+def function_%(index)d(a, b, c):
+  """
+  :type a: int
+  :type b: List[str]
+  :type c: Dict[str, Optional[int]]
+  :rtype: Tuple[int, str]
+  """
+'''
+
+
+def ImportBenchmarks(num_functions):
+  """Yields (name, size, function) to measure the cost of imports."""
+  directory = tempfile.mkdtemp()
+  path = os.path.join(directory, "benchmark_module.py")
+  with open(path, "w") as module_file:
+    module_file.write("from safetynet import *\n")
+    for index in range(num_functions):
+      module_file.write(MODULE_FUNCTION % dict(index=index))
+
+  def Import():
+    __import__("benchmark_module")
+    del sys.modules["benchmark_module"]
+
+  sys.path.insert(0, directory)
+  try:
+    yield "import.module", num_functions, Import
+  finally:
+    sys.path.remove(directory)
+    shutil.rmtree(directory)
+
+
+def RunBenchmarks(sizes, min_time, repeat):
+  """Runs all benchmarks and returns a list of result dicts."""
+  benchmarks = [CallBenchmarks(), ContainerBenchmarks(sizes),
+                ClassBenchmarks(100), ImportBenchmarks(100)]
+  results = []
+  for generator in benchmarks:
+    for name, size, function in generator:
+      seconds = Measure(function, min_time, repeat)
+      results.append(dict(name=name, size=size, seconds=seconds,
+                          calls_per_second=1.0 / seconds))
+      sys.stderr.write("%-24s %10s %14.3f us\n" %
+                       (name, size if size is not None else "",
+                        seconds * 1e6))
+  return results
+
+
+def Compare(results, previous_results):
+  """Prints how much each benchmark changed compared to previous_results."""
+  previous = dict(((result["name"], result["size"]), result["seconds"])
+                  for result in previous_results)
+  print("%-24s %10s %14s %14s %8s" %
+        ("benchmark", "size", "previous us", "current us", "change"))
+  for result in results:
+    key = (result["name"], result["size"])
+    if key not in previous:
+      continue
+    print("%-24s %10s %14.3f %14.3f %+7.1f%%" % (
+        result["name"], result["size"] if result["size"] is not None else "",
+        previous[key] * 1e6, result["seconds"] * 1e6,
+        (result["seconds"] / previous[key] - 1) * 100))
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                      help="Container sizes for the check benchmarks.")
+  parser.add_argument("--min-time", type=float, default=0.2,
+                      help="Minimum time in seconds of each measurement.")
+  parser.add_argument("--repeat", type=int, default=3,
+                      help="Number of measurements of each benchmark.")
+  parser.add_argument("--output", help="File to write the JSON results to.")
+  parser.add_argument("--compare", help="JSON results of a previous run.")
+  args = parser.parse_args(argv)
+
+  results = dict(python=platform.python_version(),
+                 implementation=platform.python_implementation(),
+                 benchmarks=RunBenchmarks(args.sizes, args.min_time,
+                                          args.repeat))
+  if args.output:
+    with open(args.output, "w") as output_file:
+      json.dump(results, output_file, indent=2, sort_keys=True)
+  else:
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+  if args.compare:
+    with open(args.compare) as compare_file:
+      Compare(results["benchmarks"], json.load(compare_file)["benchmarks"])
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,547 @@
+"""Offline checks of safetynet type check strings and interfaces.
+
+Source files are parsed, but never imported or executed. Run with:
+  python safetynet_lint.py src/ --jobs 8
+
+or the safetynet command once installed.
+"""
+from __future__ import print_function
+
+import argparse
+import ast
+import collections
+import itertools
+import multiprocessing
+import os
+import sys
+
+import safetynet
+
+try:
+  import builtins as _builtins
+except ImportError:
+  import __builtin__ as _builtins
+
+# AST nodes of type check strings that are safe to evaluate with
+# placeholders for the names of the checked module.
+if hasattr(ast, "Constant"):
+  _constant_nodes = (ast.Constant,)
+else:
+  _constant_nodes = (ast.Num, ast.Str)
+_safe_nodes = _constant_nodes + tuple(
+    getattr(ast, name) for name in ("Expression", "Name", "Load", "Attribute",
+                                    "Subscript", "Index", "Slice", "ExtSlice",
+                                    "Tuple", "Call", "keyword")
+    if hasattr(ast, name))
+
+# AST nodes of function definitions, and of annotated assignments on Python
+# 3.6+.
+_function_nodes = tuple(getattr(ast, name)
+                        for name in ("FunctionDef", "AsyncFunctionDef")
+                        if hasattr(ast, name))
+_ann_assign_nodes = tuple(getattr(ast, name) for name in ("AnnAssign",)
+                          if hasattr(ast, name))
+
+
+class LintClass(collections.namedtuple(
+    "LintClass", "name path line bases metaclass members type_errors")):
+  """A class found by LintModule.
+
+  name and bases are qualified names, metaclass is the qualified name of an
+  explicitly set metaclass or None. Builtin bases are qualified with the
+  module of builtins, bases that can not be resolved are None. members maps
+  names to (kind, arg_names, line), where kind is "function", "property" or "other". type_errors are
+  (line, message) of type check strings of its methods.
+  """
+  __slots__ = ()
+
+
+class Placeholder(object):
+  """Stands in for a name of a checked module, which is never imported."""
+  def __init__(self, name):
+    self.name = name
+
+  def __getattr__(self, name):
+    if name.startswith("__"):
+      raise AttributeError(name)
+    return Placeholder("%s.%s" % (self.name, name))
+
+  def __getitem__(self, key):
+    return self
+
+  def __call__(self, *args, **kwargs):
+    return self
+
+  def __repr__(self):
+    return self.name
+
+
+def DottedName(node):
+  """Returns the dotted name of a Name or Attribute node, or None."""
+  if isinstance(node, ast.Name):
+    return node.id
+  if isinstance(node, ast.Attribute):
+    value = DottedName(node.value)
+    return value and "%s.%s" % (value, node.attr)
+  return None
+
+
+def NestedBodies(node):
+  """Yields the lists of statements nested in a statement, e.g. an if."""
+  for field in ("body", "orelse", "finalbody", "handlers"):
+    body = getattr(node, field, None)
+    # The body of exec statements on Python 2 is an expression.
+    if isinstance(body, list):
+      yield body
+
+
+def ArgNamesOfNode(node):
+  """Like safetynet._GetArgNames, for a function definition node."""
+  args = getattr(node.args, "posonlyargs", []) + node.args.args
+  return [getattr(arg, "arg", getattr(arg, "id", None)) for arg in args]
+
+
+class LintModule(object):
+  """Collects the type check strings and classes of a module's source.
+
+  Nothing in the module is executed. Names are resolved against the names
+  bound at module level, type check strings are evaluated with placeholders
+  for anything that is not from safetynet or a builtin.
+  """
+  def __init__(self, path, module_name):
+    self.path = path
+    self.module_name = module_name
+    # Names bound at module level, mapped to their qualified names.
+    self.bindings = {}
+    # If a star import binds names that are not known.
+    self.incomplete = False
+    self.errors = []
+    self.classes = []
+
+  def Lint(self, source):
+    try:
+      tree = ast.parse(source, self.path)
+    except SyntaxError as e:
+      self.errors.append((self.path, e.lineno or 0,
+                          "Syntax error: %s" % e.msg))
+      return
+    self.BindNames(tree.body)
+    self.VisitBody(tree.body, None, "<module>")
+
+  def BindNames(self, body):
+    for node in body:
+      if isinstance(node, ast.Import):
+        for alias in node.names:
+          if alias.asname:
+            self.bindings[alias.asname] = alias.name
+          else:
+            name = alias.name.split(".")[0]
+            self.bindings[name] = name
+      elif isinstance(node, ast.ImportFrom):
+        module = self.ResolveImport(node.module, node.level)
+        for alias in node.names:
+          if alias.name == "*":
+            self.BindStarImport(module)
+          else:
+            self.bindings[alias.asname or alias.name] = "%s.%s" % (
+                module, alias.name)
+      elif isinstance(node, _function_nodes + (ast.ClassDef,)):
+        self.bindings[node.name] = "%s.%s" % (self.module_name, node.name)
+      elif isinstance(node, ast.Assign):
+        for target in node.targets:
+          self.BindTarget(target)
+      elif isinstance(node, _ann_assign_nodes):
+        # A bare annotation does not bind the name.
+        if node.value is not None:
+          self.BindTarget(node.target)
+      else:
+        # Targets of loop and with statements, e.g. for name in ...
+        self.BindTarget(getattr(node, "target", None))
+        self.BindTarget(getattr(node, "optional_vars", None))
+        for item in getattr(node, "items", None) or []:
+          self.BindTarget(item.optional_vars)
+        # Names bound in if, try, with and loop statements.
+        for body in NestedBodies(node):
+          self.BindNames(body)
+
+  def BindTarget(self, target):
+    """Binds all names of an assignment target, which may be None."""
+    if target is None:
+      return
+    for name_node in ast.walk(target):
+      if isinstance(name_node, ast.Name):
+        self.bindings[name_node.id] = "%s.%s" % (self.module_name,
+                                                  name_node.id)
+
+  def BindStarImport(self, module):
+    if module == "safetynet":
+      for name in safetynet.__all__:
+        self.bindings[name] = "safetynet.%s" % name
+    else:
+      self.incomplete = True
+
+  def ResolveImport(self, module, level):
+    if not level:
+      return module
+    package = self.module_name.split(".")
+    if not self.path.endswith("__init__.py"):
+      package = package[:-1]
+    package = package[:len(package) - level + 1]
+    return ".".join(package + ([module] if module else []))
+
+  def Qualify(self, dotted_name):
+    """Returns the qualified name of a dotted name used in the module."""
+    if dotted_name is None:
+      return None
+    first, _, rest = dotted_name.partition(".")
+    qualified = self.bindings.get(first)
+    if qualified is None:
+      return None
+    return qualified + ("." + rest if rest else "")
+
+  def IsTypecheckDecorator(self, node):
+    if isinstance(node, ast.Call):
+      node = node.func
+    return self.Qualify(DottedName(node)) in ("safetynet.typecheck",
+                                               "safetynet._TypecheckDecorator")
+
+  def VisitBody(self, body, lint_class, self_name):
+    for node in body:
+      if isinstance(node, ast.ClassDef):
+        self.VisitClass(node, self_name)
+      elif isinstance(node, _function_nodes):
+        self.VisitFunction(node, lint_class, self_name)
+      else:
+        for body in NestedBodies(node):
+          self.VisitBody(body, lint_class, self_name)
+
+  def VisitClass(self, node, self_name):
+    if self_name == "<module>":
+      name = "%s.%s" % (self.module_name, node.name)
+    else:
+      name = "%s.<locals>.%s" % (self.module_name, node.name)
+    metaclass = None
+    for keyword in getattr(node, "keywords", []):
+      if keyword.arg == "metaclass":
+        metaclass = self.Qualify(DottedName(keyword.value))
+    members = {}
+    for child in node.body:
+      if isinstance(child, ast.Assign):
+        for target in child.targets:
+          if isinstance(target, ast.Name):
+            if target.id == "__metaclass__":
+              metaclass = self.Qualify(DottedName(child.value))
+            members[target.id] = ("other", None, child.lineno)
+      elif isinstance(child, _ann_assign_nodes):
+        if isinstance(child.target, ast.Name) and child.value is not None:
+          members[child.target.id] = ("other", None, child.lineno)
+      elif isinstance(child, ast.ClassDef):
+        members[child.name] = ("other", None, child.lineno)
+      elif isinstance(child, _function_nodes):
+        members[child.name] = self.MemberKind(child)
+    bases = []
+    for base in node.bases:
+      base_name = DottedName(base)
+      qualified = self.Qualify(base_name)
+      if qualified is None and base_name and hasattr(_builtins, base_name):
+        qualified = "%s.%s" % (_builtins.__name__, base_name)
+      bases.append(qualified)
+    lint_class = LintClass(name, self.path, node.lineno, bases, metaclass,
+                           members, [])
+    self.classes.append(lint_class)
+    self.VisitBody(node.body, lint_class, node.name)
+
+  def MemberKind(self, node):
+    """Returns (kind, arg_names, line) of a method, see LintClass."""
+    kind = "function"
+    for decorator in node.decorator_list:
+      name = DottedName(decorator)
+      if name in ("staticmethod", "classmethod"):
+        kind = "method"
+      elif name == "property" or (name and name.endswith((".setter",
+                                                          ".deleter"))):
+        return "property", None, node.lineno
+      elif not self.IsTypecheckDecorator(decorator):
+        return "other", None, node.lineno
+    if kind == "method":
+      return "other", ArgNamesOfNode(node), node.lineno
+    return kind, ArgNamesOfNode(node), node.lineno
+
+  def VisitFunction(self, node, lint_class, self_name):
+    decorated = any(self.IsTypecheckDecorator(decorator)
+                    for decorator in node.decorator_list)
+    # Methods TypecheckMeta would decorate, see ListMembersOfInterest.
+    member_of_interest = (
+        lint_class is not None and
+        self.MemberKind(node)[0] in ("function", "property") and
+        (not node.name.endswith("__") or node.name == "__init__"))
+    if decorated or member_of_interest:
+      errors = self.LintDocstring(node, self_name)
+      if decorated:
+        self.errors.extend((self.path, line, message)
+                           for line, message in errors)
+      else:
+        lint_class.type_errors.extend(errors)
+    self.VisitBody(node.body, None, node.name)
+
+  def LintDocstring(self, node, self_name):
+    """Returns (line, message) of all invalid type checks of a function."""
+    errors = []
+    docstring = ast.get_docstring(node, clean=False)
+    type_check_strings = safetynet._ParseDocstring(docstring)
+    for name, type_check_string in sorted(type_check_strings.items()):
+      message = self.LintTypeCheckString(type_check_string, self_name)
+      if message:
+        target = ("return value" if name == "returns"
+                  else "argument %s" % name)
+        errors.append((node.lineno, "Invalid type check '%s' for %s of %s: %s"
+                       % (type_check_string, target, node.name, message)))
+    return errors
+
+  def LintTypeCheckString(self, type_check_string, self_name):
+    """Returns why type_check_string can not be resolved, or None."""
+    try:
+      tree = ast.parse(type_check_string.strip(), mode="eval")
+    except SyntaxError:
+      return "invalid syntax"
+
+    names = set(node.id for node in ast.walk(tree)
+                if isinstance(node, ast.Name))
+    unknown = sorted(name for name in names
+                     if name not in self.bindings and name != self_name and
+                     not hasattr(_builtins, name))
+    if unknown and not self.incomplete:
+      return "unknown name %s" % ", ".join(unknown)
+    if unknown:
+      return None
+
+    # Only evaluate plain names, subscripts and calls of names of the module.
+    for node in ast.walk(tree):
+      if not isinstance(node, _safe_nodes):
+        return None
+      if isinstance(node, ast.Call):
+        name = DottedName(node.func)
+        if not name or name.split(".")[0] not in self.bindings:
+          return None
+
+    namespace = {"__builtins__": {}}
+    for name in names - set([self_name]):
+      namespace[name] = self.PlaceholderFor(name)
+    namespace[self_name] = safetynet.Typename[self_name]
+    try:
+      safetynet._CompileTypeCheck(
+          eval(compile(tree, "<type check>", "eval"), namespace))
+    except Exception as e:
+      return str(e) or type(e).__name__
+    return None
+
+  def PlaceholderFor(self, name):
+    qualified = self.bindings.get(name)
+    if qualified is None:
+      return getattr(_builtins, name)
+    if qualified == "safetynet":
+      return safetynet
+    module, _, attribute = qualified.rpartition(".")
+    if module == "safetynet" and attribute in safetynet.__all__:
+      return getattr(safetynet, attribute)
+    return Placeholder(qualified)
+
+
+def LintFile(path_and_module):
+  """Lints a single file. Returns a list of errors and of LintClasses."""
+  path, module_name = path_and_module
+  with open(path, "rb") as source_file:
+    source = source_file.read()
+  lint_module = LintModule(path, module_name)
+  lint_module.Lint(source)
+  return lint_module.errors, lint_module.classes
+
+
+def LintInterfaces(classes):
+  """Returns the errors InterfaceMeta and TypecheckMeta would raise."""
+  classes_by_name = dict((lint_class.name, lint_class)
+                         for lint_class in classes)
+  metaclasses = {}
+  mros = {}
+  meta_names = ("safetynet.TypecheckMeta", "safetynet.InterfaceMeta")
+
+  def Metaclass(name):
+    """Returns the metaclass of a known class by qualified name or None."""
+    if name not in metaclasses:
+      metaclasses[name] = None
+      lint_class = classes_by_name.get(name)
+      if lint_class:
+        metaclass = lint_class.metaclass
+        for base in lint_class.bases:
+          metaclass = metaclass or Metaclass(base)
+        if metaclass in meta_names:
+          metaclasses[name] = metaclass
+    return metaclasses[name]
+
+  def Parents(lint_class, metaclass):
+    """Like TypecheckMeta.InheritedMembers, returns parents using it."""
+    return [base for base in lint_class.bases
+            if Metaclass(base) == metaclass or (
+                metaclass == meta_names[0] and Metaclass(base) is not None)]
+
+  def Mro(name):
+    """Returns the MRO of a class by qualified name, see _MergeMros.
+
+    Falls back to depth first order if the bases can not be merged.
+    """
+    if name not in mros:
+      mros[name] = [name]
+      lint_class = classes_by_name.get(name)
+      if lint_class is not None:
+        base_mros = [Mro(base) for base in lint_class.bases]
+        try:
+          mros[name] = [name] + safetynet._MergeMros(
+              base_mros + [lint_class.bases])
+        except TypeError:
+          for base in itertools.chain(*base_mros):
+            if base not in mros[name]:
+              mros[name].append(base)
+    return mros[name]
+
+  def OwnMembers(name):
+    """Returns members of a class by name to (class name, member).
+
+    Members of builtin classes include the ones they inherit. Returns None
+    for unknown classes.
+    """
+    lint_class = classes_by_name.get(name)
+    if lint_class is not None:
+      class_name = lint_class.name.rpartition(".")[2]
+      return dict((member_name, (class_name, member))
+                  for member_name, member in lint_class.members.items())
+    module, _, attribute = (name or "").rpartition(".")
+    builtin = getattr(_builtins, attribute, None)
+    if module != _builtins.__name__ or not isinstance(builtin, type):
+      return None
+    return dict((member_name, (attribute, ("other", None, None)))
+                for member_name in dir(builtin))
+
+  def InheritedMembers(lint_class):
+    """Like TypecheckMeta.InheritedMembers, returns (members, complete).
+
+    complete is False if the members of a base are unknown.
+    """
+    inherited_members = {}
+    complete = True
+    for base in reversed(Mro(lint_class.name)[1:]):
+      base_members = OwnMembers(base)
+      if base_members is None:
+        complete = False
+        continue
+      inherited_members.update(
+          (name, member) for name, member in base_members.items()
+          if not name.endswith("__") or name == "__init__")
+    return inherited_members, complete
+
+  errors = []
+  for lint_class in classes:
+    metaclass = Metaclass(lint_class.name)
+    if metaclass is None:
+      continue
+    errors.extend((lint_class.path, line, message)
+                  for line, message in lint_class.type_errors)
+    parents = Parents(lint_class, metaclass)
+    if metaclass != meta_names[1] or not parents:
+      continue
+
+    inherited_members, complete = InheritedMembers(lint_class)
+    class_name = lint_class.name.rpartition(".")[2]
+    parent_name = parents[0].rpartition(".")[2]
+    for name, (kind, arg_names, line) in sorted(lint_class.members.items()):
+      if kind not in ("function", "property") or name == "__init__" or (
+          name.endswith("__")):
+        continue
+      parent_class_name, parent_member = inherited_members.get(
+          name, (None, None))
+      if parent_member is None:
+        if complete and not name.startswith("_"):
+          errors.append((lint_class.path, line,
+                         "Public method %s.%s has not been defined in %s" %
+                         (class_name, name, parent_name)))
+      elif (kind == "function" and parent_member[1] is not None and
+            parent_member[1] != arg_names):
+        errors.append((lint_class.path, line,
+                       "Overriding %s.%s in %s with different argument names"
+                       % (parent_class_name, name, class_name)))
+  return errors
+
+
+def FindSourceFiles(paths):
+  """Yields (path, module name) of all python files in paths."""
+  for path in paths:
+    if not os.path.isdir(path):
+      yield path, os.path.splitext(os.path.basename(path))[0]
+      continue
+    for directory, subdirectories, files in os.walk(path):
+      subdirectories[:] = sorted(name for name in subdirectories
+                                 if not name.startswith("."))
+      package = os.path.relpath(directory, path).split(os.sep)
+      if package == ["."]:
+        package = []
+      for name in sorted(files):
+        if not name.endswith(".py"):
+          continue
+        module = os.path.splitext(name)[0]
+        module_path = package + ([] if module == "__init__" else [module])
+        yield os.path.join(directory, name), ".".join(module_path)
+
+
+def Lint(paths, jobs=None):
+  """Lints all python files in paths. Returns a sorted list of errors.
+
+  Each error is a tuple of (path, line, message). Files are parsed in a pool
+  of jobs processes, classes are checked against their parents afterwards.
+
+  :param int jobs: Number of processes, defaults to the number of CPUs. 1
+    lints in the current process.
+  """
+  files = list(FindSourceFiles(paths))
+  if jobs == 1 or len(files) <= 1:
+    results = [LintFile(path_and_module) for path_and_module in files]
+  else:
+    pool = multiprocessing.Pool(jobs)
+    try:
+      results = pool.map(LintFile, files, chunksize=16)
+    finally:
+      pool.close()
+      pool.join()
+
+  errors = []
+  classes = []
+  for file_errors, file_classes in results:
+    errors.extend(file_errors)
+    classes.extend(file_classes)
+  errors.extend(LintInterfaces(classes))
+  return sorted(errors)
+
+
+def main(argv=None):
+  """Command line tool checking type checks without importing any code.
+
+  Reports type check strings in docstrings of typechecked functions that
+  can not be resolved, and classes InterfaceMeta would reject. Returns 1 if
+  any errors were found.
+  """
+  parser = argparse.ArgumentParser(
+      description="Checks safetynet type checks and interfaces in python "
+                  "source files without running them.")
+  parser.add_argument("paths", nargs="+",
+                      help="Python files or directories to check.")
+  parser.add_argument("-j", "--jobs", type=int, default=None,
+                      help="Number of processes. Defaults to the number of "
+                           "CPUs.")
+  args = parser.parse_args(argv)
+
+  errors = Lint(args.paths, args.jobs)
+  for path, line, message in errors:
+    print("%s:%d: %s" % (path, line, message))
+  return 1 if errors else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
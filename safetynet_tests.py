@@ -1,8 +1,152 @@
 from collections import OrderedDict
+import array
+import gc
+import logging
+import multiprocessing
+import pickle
+import sys
+import threading
+import time
 import unittest
+import weakref
 
-from safetynet import (Dict, InterfaceMeta, List, Optional, Tuple,
-                       _ValidateValue, typecheck)
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+from safetynet import (CheckEvery, CheckFirst, CheckRandom, Dict, FileSink,
+                       InterfaceMeta, Iterator, List, NDArray, NotRequired,
+                       Optional, OptionalChecker, Record, Tuple, Typed,
+                       TypecheckError, TypecheckMeta, Typename, Union,
+                       _ValidateValue, cache_clear, cache_info, configure,
+                       flush_violations, reset_stats, stats, stats_report,
+                       typecheck, unchecked)
+from safetynet_lint import Lint
+
+
+LINT_BASE_MODULE = """
+from safetynet import *
+
+
+class Base(object):
+  __metaclass__ = InterfaceMeta
+
+  def Method(self, a, b):
+    \"""
+    :param int a:
+    :param List[Missing] b:
+    \"""
+
+
+@typecheck
+def Function(a, b):
+  \"""
+  :type a: Dict[str
+  :rtype: Base
+  \"""
+"""
+
+LINT_SUB_MODULE = """
+from base import Base
+
+
+class Sub(Base):
+  def Method(self, a, c):
+    \"""
+    :type a: Sub
+    :type c: Unknown
+    \"""
+
+  def Public(self):
+    pass
+"""
+
+LINT_TARGETS_MODULE = """
+from safetynet import *
+
+for Loop in (int,):
+  pass
+
+with open(__file__) as Context:
+  pass
+
+
+@typecheck
+def Function(a, b):
+  \"""
+  :type a: Loop
+  :type b: Context
+  \"""
+"""
+
+LINT_MIXIN_MODULE = """
+from external import External
+from safetynet import *
+
+
+class Mixin(object):
+  def Shared(self, a):
+    pass
+
+
+class Base(Mixin):
+  __metaclass__ = InterfaceMeta
+
+
+class Sub(Base):
+  def Shared(self, a):
+    pass
+
+
+class Renamed(Base):
+  def Shared(self, b):
+    pass
+
+
+class DictBase(dict):
+  __metaclass__ = InterfaceMeta
+
+
+class DictSub(DictBase):
+  def get(self, key, default=None):
+    pass
+
+
+class ExternalBase(External):
+  __metaclass__ = InterfaceMeta
+
+
+class ExternalSub(ExternalBase):
+  def Method(self):
+    pass
+"""
+
+LINT_PY3_MODULE = """
+from safetynet import *
+
+Alias: type = int
+Missing: type
+
+
+class Base(metaclass=InterfaceMeta):
+  async def Method(self, a):
+    \"""
+    :type a: Alias
+    \"""
+
+
+class Sub(Base):
+  async def Method(self, b):
+    pass
+
+
+@typecheck
+def Function(a):
+  \"""
+  :type a: Missing
+  \"""
+"""
 
 
 class CustomType(object):
@@ -11,6 +155,21 @@ class CustomType(object):
 class CustomSubType(CustomType):
   pass
 
+def WithMetaclass(metaclass, *bases):
+  """Returns a base class that creates subclasses with metaclass.
+
+  Works like six.with_metaclass: the returned class replaces itself with
+  bases, so the tests run on Python 2 and 3, where __metaclass__ is ignored.
+  """
+  bases = bases or (object,)
+
+  class TemporaryMetaclass(type):
+    def __new__(cls, name, this_bases, namespace):
+      return metaclass(name, bases, namespace)
+
+  return type.__new__(TemporaryMetaclass, "TemporaryClass", (), {})
+
+
 def DefineTypeCheckExample():
   """Defines an example class.
 
@@ -18,8 +177,7 @@ def DefineTypeCheckExample():
   InterfaceMeta are thrown at the time of definition. We want to catch those
   in the tests.
   """
-  class TypeCheckExample(object):
-    __metaclass__ = InterfaceMeta
+  class TypeCheckExample(WithMetaclass(InterfaceMeta)):
 
     def docstring_example(self, a, b, c, d, e, return_):
       """ Docstring
@@ -49,6 +207,21 @@ def DefineTypeCheckExample():
   return TypeCheckExample
 
 
+@typecheck(a=int, returns=int)
+def PicklableFunction(a):
+  return a * 2
+
+
+class PicklableExample(WithMetaclass(TypecheckMeta)):
+
+  def Double(self, a):
+    """
+    :type a: int
+    :rtype: int
+    """
+    return a * 2
+
+
 class TypeCheckTests(unittest.TestCase):
 
   def assert_correct_example_type_checks(self, function):
@@ -218,8 +391,7 @@ class TypeCheckTests(unittest.TestCase):
     self.assertRaises(TypeError, DefineClass)
 
   def test_object_init_check(self):
-    class Example(object):
-      __metaclass__ = InterfaceMeta
+    class Example(WithMetaclass(InterfaceMeta)):
       def __init__(self, a, b):
         """
         :param bool a:
@@ -230,8 +402,7 @@ class TypeCheckTests(unittest.TestCase):
     self.assertRaises(TypeError, lambda: Example(1, "str"))
 
   def test_property_check(self):
-    class Example(object):
-      __metaclass__ = InterfaceMeta
+    class Example(WithMetaclass(InterfaceMeta)):
       @property
       def valid(self):
         """
@@ -250,8 +421,7 @@ class TypeCheckTests(unittest.TestCase):
     self.assertRaises(TypeError, lambda: instance.invalid)
 
   def test_class_variables_untouched(self):
-    class VariablesExample:
-      __metaclass__ = InterfaceMeta
+    class VariablesExample(WithMetaclass(InterfaceMeta)):
       variable = 1
     self.assertEqual(VariablesExample.variable, 1)
 
@@ -262,3 +432,912 @@ class TypeCheckTests(unittest.TestCase):
     self.assertFalse(_ValidateValue(("1", "str"), Tuple[int, str]))
     self.assertFalse(_ValidateValue((1, "str", 3), Tuple[int, str]))
     self.assertFalse(_ValidateValue((), Tuple[int, str]))
+
+  def test_error_message(self):
+    @typecheck(a=int, b=str)
+    def test_function(a, b, c):
+      pass
+    try:
+      test_function(1, 2, None)
+    except TypeError as e:
+      self.assertEqual(str(e), "Invalid value '2' for argument b. Expected str")
+    else:
+      self.fail("TypeError not raised")
+
+  def test_keyword_argument_check(self):
+    @typecheck(a=int, b=str)
+    def test_function(a=0, **kwargs):
+      pass
+    test_function()
+    test_function(a=1, b="str", c=None)
+    self.assertRaises(TypeError, test_function, "1")
+    self.assertRaises(TypeError, test_function, b=1)
+
+  def test_list_sampling(self):
+    self.assertTrue(_ValidateValue([1, 2, "3"], List(int, sample=2)))
+    self.assertFalse(_ValidateValue(["1", 2, 3], List(int, sample=2)))
+    self.assertFalse(_ValidateValue(["1"] * 10,
+                                    List(int, sample=CheckRandom(3))))
+    self.assertTrue(_ValidateValue(iter([1, 2, "3"]), List(int, sample=2)))
+
+    every = List(int, sample=CheckEvery(2))
+    self.assertFalse(_ValidateValue(["1"], every))
+    self.assertTrue(_ValidateValue(["1"], every))
+    self.assertFalse(_ValidateValue(["1"], every))
+
+  def test_dict_sampling(self):
+    checker = Dict(str, int, sample=CheckFirst(1))
+    self.assertTrue(_ValidateValue({"a": 1}, checker))
+    self.assertFalse(_ValidateValue({"a": "1"}, checker))
+
+  def test_default_sampling(self):
+    configure(sample=1)
+    try:
+      self.assertTrue(_ValidateValue([1, "2"], List[int]))
+      self.assertFalse(_ValidateValue([1, "2"], List(int, sample=False)))
+    finally:
+      configure(sample=None)
+    self.assertFalse(_ValidateValue([1, "2"], List[int]))
+    self.assertRaises(TypeError, configure, unknown_option=1)
+
+  def test_off_mode(self):
+    configure(mode="off")
+    try:
+      def undecorated(a):
+        """
+        :param int a:
+        """
+      self.assertIs(typecheck(undecorated), undecorated)
+      self.assertIs(typecheck(a="UnknownName")(undecorated), undecorated)
+
+      class Example(DefineTypeCheckExample()):
+        def docstring_example(self, a, b, c, d, e, return_):
+          return return_
+      self.assertEqual(Example().docstring_example(*[None] * 6), None)
+
+      def DefineClass():
+        class OverrideExample(Example):
+          def docstring_example(self, a, b, c, CHANGES, e, return_):
+            pass
+      self.assertRaises(TypeError, DefineClass)
+      configure(interface_checks=False)
+      DefineClass()
+    finally:
+      configure(mode="check", interface_checks=True)
+    self.assertRaises(TypeError, configure, mode="unknown")
+
+  def test_validation_cache(self):
+    checker = Tuple[int, str]
+    value = (1, "str")
+    configure(cache_size=2)
+    try:
+      cache_clear()
+      self.assertTrue(_ValidateValue(value, checker))
+      self.assertTrue(_ValidateValue(value, checker))
+      self.assertFalse(_ValidateValue((1, 2), checker))
+      self.assertTrue(_ValidateValue(frozenset([1, 2]), List[int]))
+      self.assertTrue(_ValidateValue([1], List[int]))
+      self.assertEqual(cache_info(), (1, 3, 2, 2))
+
+      # Mutable content is never cached.
+      self.assertTrue(_ValidateValue(([1],), Tuple[List[int]]))
+      self.assertEqual(cache_info().misses, 3)
+
+      # Checks of item types are cached even for unhashable tuples.
+      unhashable = ([1],)
+      self.assertTrue(_ValidateValue(unhashable, Tuple[list]))
+      self.assertTrue(_ValidateValue(unhashable, Tuple[list]))
+      self.assertEqual(cache_info()[:2], (2, 4))
+
+      # Neither are predicates, which may depend on the state of items.
+      class Connection(object):
+        open = True
+      connection = Connection()
+      checker = Tuple[int, lambda connection: connection.open]
+      self.assertTrue(_ValidateValue((1, connection), checker))
+      connection.open = False
+      self.assertFalse(_ValidateValue((1, connection), checker))
+      self.assertEqual(cache_info().misses, 4)
+    finally:
+      configure(cache_size=0)
+      cache_clear()
+
+  def test_nested_checks(self):
+    checker = List[Tuple[int, Optional[str]]]
+    self.assertTrue(_ValidateValue([(1, "a"), (2, None)], checker))
+    self.assertFalse(_ValidateValue([(1, "a"), (2, 3)], checker))
+    self.assertFalse(_ValidateValue([(1, "a"), (2,)], checker))
+    self.assertTrue(_ValidateValue([(1, "a")], List[(int, str),]))
+    self.assertFalse(_ValidateValue([(1, 2)], List[(int, str),]))
+
+  def test_invalid_type_check(self):
+    self.assertRaises(TypeError, typecheck(a=1), lambda a: None)
+
+  def test_array_list_check(self):
+    self.assertTrue(_ValidateValue(array.array("d", [1.0] * 10), List[float]))
+    self.assertFalse(_ValidateValue(array.array("d", [1.0]), List[int]))
+    self.assertTrue(_ValidateValue(array.array("i"), List[str]))
+    self.assertTrue(_ValidateValue(bytearray(b"abc"), List[int]))
+    self.assertTrue(_ValidateValue("abc", List[str]))
+    self.assertFalse(_ValidateValue("abc", List[int]))
+
+  @unittest.skipIf(numpy is None, "numpy is not installed")
+  def test_ndarray_check(self):
+    floats = numpy.zeros((3, 2))
+    self.assertTrue(_ValidateValue(floats, NDArray[float, 2]))
+    self.assertTrue(_ValidateValue(floats, NDArray[numpy.floating]))
+    self.assertFalse(_ValidateValue(floats, NDArray[float, 1]))
+    self.assertFalse(_ValidateValue(floats, NDArray[numpy.integer]))
+    self.assertFalse(_ValidateValue([1.0], NDArray[float]))
+    self.assertTrue(_ValidateValue(floats[0], List[float]))
+    self.assertFalse(_ValidateValue(floats, List[float]))
+
+  def test_lazy_type_checks(self):
+    configure(lazy=True)
+    try:
+      @typecheck
+      def test_function(a):
+        """
+        :param LaterDefinedType a:
+        """
+      Example = DefineTypeCheckExample()
+      class OverrideExample(Example):
+        def docstring_example(self, a, b, c, d, e, return_):
+          return return_
+    finally:
+      configure(lazy=False)
+
+    self.assertFalse(test_function.type_checks.resolved)
+    self.assertRaises(NameError, test_function, 1)
+
+    instance = OverrideExample()
+    self.assertFalse(Example.docstring_example.type_checks.resolved)
+    self.assert_correct_example_type_checks(instance.docstring_example)
+    self.assertTrue(Example.docstring_example.type_checks.resolved)
+    self.assert_correct_example_type_checks(instance.annotation_example)
+
+  def test_lazy_type_checks_threads(self):
+    evaluations = []
+    class Slow(object):
+      def __getitem__(self, item_type):
+        evaluations.append(item_type)
+        time.sleep(0.05)
+        return item_type
+
+    namespace = dict(globals(), Slow=Slow())
+    configure(lazy=True)
+    try:
+      exec("""
+@typecheck
+def lazy_function(a):
+  '''
+  :type a: Slow[int]
+  '''
+""", namespace)
+    finally:
+      configure(lazy=False)
+    lazy_function = namespace["lazy_function"]
+
+    errors = []
+    def CallInThread():
+      try:
+        lazy_function(1)
+        lazy_function("1")
+      except TypeError:
+        pass
+      except Exception as e:
+        errors.append(e)
+    threads = [threading.Thread(target=CallInThread) for _ in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(errors, [])
+    self.assertEqual(evaluations, [int])
+
+  def test_shared_type_checks(self):
+    self.assertIs(List[int], List[int])
+    self.assertIs(Dict[str, List[int]], Dict[str, List[int]])
+    self.assertIsNot(List[int], List[float])
+    self.assertIsNot(Tuple[1], Tuple[True])
+
+    @typecheck(a="List[CustomType]")
+    def first(a):
+      pass
+    @typecheck(a="List[CustomType]")
+    def second(a):
+      pass
+    self.assertIs(first.type_checks.type_check_dict["a"],
+                  second.type_checks.type_check_dict["a"])
+
+    global CustomType
+    original = CustomType
+    CustomType = CustomSubType
+    try:
+      @typecheck(a="List[CustomType]")
+      def rebound(a):
+        pass
+    finally:
+      CustomType = original
+    self.assertIs(rebound.type_checks.type_check_dict["a"],
+                  List[CustomSubType])
+
+  def test_streamed_arguments(self):
+    @typecheck(a=List[int], b=Iterator[str])
+    def test_function(a, b=()):
+      return list(a), list(b)
+
+    self.assertEqual(test_function(x for x in [1, 2]), ([1, 2], []))
+    self.assertEqual(test_function([1], b=iter("ab")), ([1], ["a", "b"]))
+    self.assertRaises(TypeError, test_function, (x for x in [1, None]))
+    self.assertRaises(TypeError, test_function, [1], iter([1]))
+    self.assertRaises(TypeError, test_function, [None])
+    self.assertRaises(TypeError, test_function, [1], [1])
+
+  def test_streamed_arguments_not_consumed(self):
+    @typecheck(a=List[int])
+    def first(a):
+      return next(a)
+
+    pulled = []
+    def generator():
+      for item in [1, 2, 3]:
+        pulled.append(item)
+        yield item
+    self.assertEqual(first(generator()), 1)
+    self.assertEqual(pulled, [1])
+
+  def test_streamed_files(self):
+    @typecheck(lines=Iterator[str])
+    def read_lines(lines):
+      return lines.readline(), list(lines), lines.name
+
+    import os
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+      path = os.path.join(directory, "lines.txt")
+      with open(path, "w") as lines_file:
+        lines_file.write("first\nsecond\n")
+      with open(path) as lines_file:
+        self.assertEqual(read_lines(lines_file),
+                         ("first\n", ["second\n"], path))
+    finally:
+      shutil.rmtree(directory)
+
+  def test_streamed_return_value(self):
+    @typecheck
+    def test_function(items):
+      """
+      :rtype: Iterator[int]
+      """
+      for item in items:
+        received = yield item
+        if received:
+          yield received
+
+    self.assertEqual(list(test_function([1, 2])), [1, 2])
+    self.assertRaises(TypeError, list, test_function([1, "2"]))
+    generator = test_function([1])
+    self.assertEqual(next(generator), 1)
+    self.assertRaises(TypeError, generator.send, "str")
+
+  def test_stats(self):
+    @typecheck(a=int, returns=int)
+    def checked_function(a):
+      return a
+
+    reset_stats()
+    configure(stats=True)
+    try:
+      checked_function(1)
+      checked_function(2)
+      self.assertRaises(TypeError, checked_function, "3")
+    finally:
+      configure(stats=False)
+    checked_function(4)
+
+    [function_stats] = stats()
+    self.assertTrue(function_stats.name.endswith(".checked_function"))
+    self.assertEqual(function_stats.calls, 3)
+    self.assertEqual(function_stats.failures, 1)
+    self.assertTrue(function_stats.total_time > 0)
+    self.assertTrue(function_stats.max_argument_time > 0)
+    self.assertIn("checked_function", stats_report())
+
+    reset_stats()
+    self.assertEqual(stats(), [])
+
+  @unittest.skipIf(sys.version_info < (3, 7), "requires asyncio.run")
+  def test_coroutine_function(self):
+    import asyncio
+    namespace = dict(globals(), asyncio=asyncio)
+    exec("""
+@typecheck(a=int, returns=int)
+async def coroutine_function(a, result):
+  await asyncio.sleep(0)
+  return result
+""", namespace)
+    coroutine_function = namespace["coroutine_function"]
+
+    self.assertTrue(asyncio.iscoroutinefunction(coroutine_function))
+    self.assertEqual(asyncio.run(coroutine_function(1, 2)), 2)
+    self.assertRaises(TypeError, coroutine_function, "1", 2)
+    self.assertRaises(TypeError, asyncio.run, coroutine_function(1, "2"))
+
+  @unittest.skipIf(sys.version_info < (3, 7), "requires asyncio.run")
+  def test_async_generator_function(self):
+    import asyncio
+    namespace = dict(globals())
+    exec("""
+@typecheck(returns=Iterator[int])
+async def async_generator_function(items):
+  for item in items:
+    yield item
+
+async def collect(items):
+  return [item async for item in async_generator_function(items)]
+""", namespace)
+    collect = namespace["collect"]
+
+    self.assertEqual(asyncio.run(collect([1, 2])), [1, 2])
+    self.assertRaises(TypeError, asyncio.run, collect([1, "2"]))
+
+  def test_report_mode(self):
+    violations = []
+    flush_violations()
+    configure(mode="report", report_sink=violations.append)
+    try:
+      @typecheck(a=int, b=Iterator[int], returns=int)
+      def report_function(a, b):
+        list(b)
+        return a
+
+      self.assertEqual(report_function("1", iter([1])), "1")
+      self.assertEqual(report_function("2", iter([2])), "2")
+      self.assertEqual(report_function(3, iter(["3"])), 3)
+      flush_violations()
+    finally:
+      configure(mode="check", report_sink=None)
+
+    self.assertEqual(
+        sorted((v.argument, v.value_type, v.count) for v in violations),
+        [("a", str, 2), ("b", str, 1), ("returns", str, 2)])
+    self.assertIn("argument a of", str(min(violations)))
+    self.assertRaises(TypeError, report_function, "1", iter([1]))
+
+  def test_report_mode_in_worker(self):
+    import os
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "violations.txt")
+    configure(mode="report", report_sink=FileSink(path))
+    try:
+      pool = multiprocessing.Pool(1)
+      try:
+        self.assertEqual(pool.apply(PicklableFunction, ("1",)), "11")
+      finally:
+        pool.close()
+        pool.join()
+      with open(path) as report_file:
+        report = report_file.read()
+    finally:
+      configure(mode="check", report_sink=None)
+      shutil.rmtree(directory)
+    self.assertIn("for argument a of safetynet_tests.PicklableFunction",
+                  report)
+
+  def test_typecheck_error(self):
+    @typecheck(a=int, b=List[Dict[str, int]], returns=Tuple[int, str])
+    def error_function(a, b):
+      return (a, a)
+
+    b = [{"key": 1}] * 2000
+    b[1532] = {"key": "1"}
+    try:
+      error_function(1, b)
+    except TypecheckError as e:
+      self.assertEqual((e.argument, e.value), ("b", b))
+      self.assertEqual(str(e), "Invalid value '1' for argument b at "
+                       "b[1532]['key']. Expected int")
+    else:
+      self.fail("TypecheckError not raised")
+
+    try:
+      error_function(1, [])
+    except TypecheckError as e:
+      self.assertEqual(str(e), "Invalid return value '1' at returns[1]. "
+                       "Expected str")
+    else:
+      self.fail("TypecheckError not raised")
+
+    @typecheck(a=List(int, sample=CheckEvery(2)))
+    def sampled_function(a):
+      pass
+
+    messages = []
+    for _ in range(4):
+      try:
+        sampled_function(["x"])
+      except TypecheckError as e:
+        self.assertEqual(e.argument, "a")
+        messages.append(str(e))
+    self.assertTrue(messages)
+    self.assertEqual(set(messages), set(["Invalid value 'x' for argument a "
+                                         "at a[0]. Expected int"]))
+
+    try:
+      error_function("x" * 1000000, [])
+    except TypecheckError as e:
+      self.assertLess(len(str(e)), 200)
+      self.assertLess(len(repr(e)), 200)
+      self.assertEqual(e.args, ("a",))
+    else:
+      self.fail("TypecheckError not raised")
+
+  def test_checker_values(self):
+    import pickle
+    list_checker = type(List[int])(int, sample=CheckFirst(2))
+    self.assertIsNot(list_checker, List(int, sample=CheckFirst(2)))
+    self.assertEqual(list_checker, List(int, sample=CheckFirst(2)))
+    self.assertNotEqual(List[int], List[str])
+    self.assertNotEqual(List[int], Iterator[int])
+    self.assertNotEqual(List(int, sample=CheckEvery(2)),
+                        List(int, sample=CheckEvery(2)))
+    self.assertEqual(len(set([Dict[str, Optional[int]], Dict[str, int],
+                              Dict[str, Optional[int]]])), 2)
+    self.assertEqual(pickle.loads(pickle.dumps(Tuple[int, List[str]])),
+                     Tuple[int, List[str]])
+    self.assertRaises(AttributeError, setattr, List[int], "item_type", str)
+    self.assertFalse(hasattr(List[int], "__dict__"))
+
+  def test_class_multiple_inheritance_typechecks(self):
+    class Mixin(object):
+      pass
+
+    class MixinExample(Mixin, DefineTypeCheckExample()):
+      pass
+
+    class DiamondExample(MixinExample, DefineTypeCheckExample()):
+      def docstring_example(self, a, b, c, d, e, return_):
+        return return_
+
+    for cls in (MixinExample, DiamondExample):
+      instance = cls()
+      self.assert_correct_example_type_checks(instance.docstring_example)
+      self.assert_correct_example_type_checks(instance.annotation_example)
+
+  def test_class_diamond_inheritance_follows_mro(self):
+    def Method(self, x):
+      """
+      :type x: int
+      """
+    def OverrideMethod(self, x):
+      """
+      :type x: str
+      """
+    def InheritedMethod(self, x):
+      pass
+
+    A = TypecheckMeta("A", (object,), dict(m=Method))
+    B = TypecheckMeta("B", (A,), {})
+    C = TypecheckMeta("C", (A,), dict(m=OverrideMethod))
+    D = TypecheckMeta("D", (B, C), dict(m=InheritedMethod))
+
+    D().m("x")
+    self.assertRaises(TypeError, D().m, 1)
+
+  def test_interface_inherited_from_mixins(self):
+    class Mixin(object):
+      def Shared(self, a):
+        pass
+
+    Base = InterfaceMeta("Base", (Mixin,), {})
+
+    class Sub(Base):
+      def Shared(self, a):
+        """
+        :type a: int
+        """
+
+    DictBase = InterfaceMeta("DictBase", (dict,), {})
+
+    class DictSub(DictBase):
+      def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+    Sub().Shared(1)
+    self.assertRaises(TypeError, Sub().Shared, "1")
+    self.assertEqual(DictSub(a=1).get("a"), 1)
+
+    def DefineRenamedOverride():
+      class RenamedSub(Base):
+        def Shared(self, b):
+          pass
+    self.assertRaises(TypeError, DefineRenamedOverride)
+
+  def test_unchecked(self):
+    @typecheck(a=int, returns=int)
+    def checked_function(a):
+      return a
+
+    @unchecked
+    def unchecked_function(a):
+      return checked_function(a)
+
+    with unchecked():
+      self.assertEqual(checked_function("1"), "1")
+      with unchecked():
+        self.assertEqual(checked_function("2"), "2")
+      self.assertEqual(checked_function("3"), "3")
+    self.assertRaises(TypeError, checked_function, "1")
+
+    self.assertEqual(unchecked_function("4"), "4")
+    self.assertEqual(unchecked_function.__name__, "unchecked_function")
+    self.assertRaises(TypeError, checked_function, "4")
+
+    errors = []
+    def CallInThread():
+      try:
+        checked_function("5")
+      except TypeError as e:
+        errors.append(e)
+    with unchecked():
+      thread = threading.Thread(target=CallInThread)
+      thread.start()
+      thread.join()
+    self.assertEqual(len(errors), 1)
+
+  def test_lint(self):
+    import os
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+      with open(os.path.join(directory, "base.py"), "w") as module_file:
+        module_file.write(LINT_BASE_MODULE)
+      with open(os.path.join(directory, "sub.py"), "w") as module_file:
+        module_file.write(LINT_SUB_MODULE)
+      messages = [message for _, _, message in Lint([directory], jobs=1)]
+    finally:
+      shutil.rmtree(directory)
+    self.assertEqual(messages, [
+        "Invalid type check 'List[Missing]' for argument b of Method: "
+        "unknown name Missing",
+        "Invalid type check 'Dict[str' for argument a of Function: "
+        "invalid syntax",
+        "Invalid type check 'Unknown' for argument c of Method: "
+        "unknown name Unknown",
+        "Overriding Base.Method in Sub with different argument names",
+        "Public method Sub.Public has not been defined in Base"])
+
+  def lint_source(self, source):
+    import os
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+      with open(os.path.join(directory, "module.py"), "w") as module_file:
+        module_file.write(source)
+      return [message for _, _, message in Lint([directory], jobs=1)]
+    finally:
+      shutil.rmtree(directory)
+
+  def test_lint_loop_and_with_targets(self):
+    self.assertEqual(self.lint_source(LINT_TARGETS_MODULE), [])
+
+  def test_lint_mixin_and_builtin_bases(self):
+    self.assertEqual(self.lint_source(LINT_MIXIN_MODULE), [
+        "Overriding Mixin.Shared in Renamed with different argument names"])
+
+  @unittest.skipIf(sys.version_info < (3, 6), "requires variable annotations")
+  def test_lint_annotated_assignments_and_async_methods(self):
+    self.assertEqual(self.lint_source(LINT_PY3_MODULE), [
+        "Overriding Base.Method in Sub with different argument names",
+        "Invalid type check 'Missing' for argument a of Function: "
+        "unknown name Missing"])
+
+  @unittest.skipIf(sys.version_info < (3,), "requires annotations")
+  def test_annotations(self):
+    namespace = dict(globals())
+    exec("""
+@typecheck
+def annotated_function(a: int, b: "List[str]", c: Optional[int] = None,
+                       d=None) -> Tuple[int, str]:
+  '''
+  :type c: str
+  :type d: int
+  '''
+  return (a, b[0])
+
+@typecheck
+def fully_annotated_function(a: int) -> None:
+  '''
+  :type a: UnknownName
+  '''
+""", namespace)
+    annotated_function = namespace["annotated_function"]
+    fully_annotated_function = namespace["fully_annotated_function"]
+
+    self.assertEqual(annotated_function(1, ["b"], 1, 2), (1, "b"))
+    self.assertRaises(TypeError, annotated_function, "1", ["b"])
+    self.assertRaises(TypeError, annotated_function, 1, [2])
+    self.assertRaises(TypeError, annotated_function, 1, ["b"], "c")
+    self.assertRaises(TypeError, annotated_function, 1, ["b"], 1, "d")
+    self.assertRaises(TypeError, annotated_function, 1, [1.0])
+    self.assertIsNone(fully_annotated_function(1))
+    self.assertRaises(TypeError, fully_annotated_function, "1")
+
+  @unittest.skipIf(sys.version_info < (3, 10), "requires int | None")
+  def test_builtin_generic_annotations(self):
+    namespace = dict(globals())
+    exec("""
+@typecheck
+def generic_function(a: list[int], b: int | None = None) -> dict[str, int]:
+  '''
+  :type a: List[int]
+  '''
+  return {}
+""", namespace)
+    generic_function = namespace["generic_function"]
+
+    self.assertEqual(generic_function([]), {})
+    self.assertEqual(generic_function([1], None), {})
+    self.assertEqual(generic_function([1], 2), {})
+    self.assertRaises(TypeError, generic_function, "abc")
+    self.assertRaises(TypeError, generic_function, 5)
+    self.assertRaises(TypeError, generic_function, ["a"])
+    self.assertRaises(TypeError, generic_function, [1], "b")
+
+  def test_shared_type_checks_compile_once(self):
+    compiled = []
+
+    class CountingChecker(OptionalChecker):
+      __slots__ = ()
+
+      def Compile(self):
+        compiled.append(self)
+        return OptionalChecker.Compile(self)
+
+    namespace = dict(globals(), Counted=CountingChecker(int))
+    exec("""
+@typecheck
+def first_function(a):
+  '''
+  :type a: List[Counted]
+  '''
+
+@typecheck
+def second_function(a):
+  '''
+  :type a: Dict[str, Counted]
+  '''
+""", namespace)
+    namespace["first_function"]([1, None])
+    namespace["second_function"]({"a": 1})
+    self.assertRaises(TypeError, namespace["second_function"], {"a": "b"})
+    self.assertEqual(len(compiled), 1)
+
+  def test_parsed_type_checks_release_modules(self):
+    classes = []
+    for _ in range(50):
+      namespace = dict(globals())
+      exec("""
+class Dynamic(object):
+  pass
+
+@typecheck
+def dynamic_function(a, b):
+  '''
+  :type a: Dynamic
+  :type b: List[Dynamic]
+  '''
+""", namespace)
+      namespace["dynamic_function"](namespace["Dynamic"](), [])
+      self.assertRaises(TypeError, namespace["dynamic_function"], 1, [])
+      classes.append(weakref.ref(namespace["Dynamic"]))
+      del namespace
+    # The second collection frees classes only released by weakref callbacks.
+    gc.collect()
+    gc.collect()
+    self.assertLessEqual(len([cls for cls in classes if cls() is not None]),
+                         1)
+
+  @unittest.skipIf(sys.version_info < (3, 10), "requires int | None")
+  def test_postponed_annotations(self):
+    namespace = dict(globals())
+    exec("""from __future__ import annotations
+import typing
+
+@typecheck
+def postponed_function(a: list[int], b: int | None = None,
+                       c: typing.Optional[int] = None) -> None:
+  '''
+  :type a: List[int]
+  '''
+
+@typecheck
+def postponed_return_function(a: List[int]) -> None:
+  return a[0] if a else None
+""", namespace)
+    postponed_function = namespace["postponed_function"]
+    postponed_return_function = namespace["postponed_return_function"]
+
+    self.assertIsNone(postponed_function([1], 2, 3))
+    self.assertIsNone(postponed_function([1], None, None))
+    self.assertRaises(TypeError, postponed_function, "abc")
+    self.assertRaises(TypeError, postponed_function, 5)
+    self.assertRaises(TypeError, postponed_function, [1], "b")
+    self.assertIsNone(postponed_return_function([]))
+    self.assertRaises(TypeError, postponed_return_function, [1])
+    self.assertRaises(TypeError, postponed_return_function, ["a"])
+
+  def test_type_dispatch_invalidation(self):
+    try:
+      from collections.abc import Iterable
+    except ImportError:
+      from collections import Iterable
+
+    class Registered(object):
+      pass
+
+    @typecheck(a=List(), b=Dict(), c=Typename["Registered"])
+    def dispatch_function(a=(), b={}, c=Registered()):
+      pass
+
+    dispatch_function([], {}, Registered())
+    self.assertRaises(TypeError, dispatch_function, Registered())
+    self.assertRaises(TypeError, dispatch_function, b=[])
+    self.assertRaises(TypeError, dispatch_function, c=[])
+    Iterable.register(Registered)
+    dispatch_function(Registered())
+
+  def test_record(self):
+    Payload = Record["name": str, "tags": List[str],
+                     "parent": NotRequired[Record["id": int]]]
+
+    @typecheck(payload=Payload)
+    def record_function(payload):
+      pass
+
+    record_function({"name": "a", "tags": []})
+    record_function({"name": "a", "tags": ["b"], "parent": {"id": 1},
+                     "extra": None})
+    record_function(OrderedDict([("name", "a"), ("tags", ())]))
+    self.assertRaises(TypeError, record_function, [("name", "a")])
+    self.assertRaises(TypeError, record_function, {"name": "a"})
+    self.assertRaises(TypeError, record_function, {"name": 1, "tags": []})
+    self.assertEqual(Record({"id": int}), Record["id": int])
+    self.assertRaises(TypeError, Record, "id")
+
+    try:
+      record_function({"name": "a", "tags": [], "parent": {}})
+    except TypecheckError as e:
+      self.assertEqual(str(e), "Invalid value '<missing>' for argument "
+                       "payload at payload['parent']['id']. Expected int")
+    else:
+      self.fail("TypecheckError not raised")
+
+  def test_union(self):
+    @typecheck(a=Union[int, str, None, List[int], Tuple[int, int]])
+    def union_function(a):
+      pass
+
+    for value in (1, "a", None, [1], (1, 2)):
+      union_function(value)
+    for value in (1.0, ["a"], ("a", 1)):
+      self.assertRaises(TypeError, union_function, value)
+
+    self.assertEqual(Union[int, Union[str, float]], Union[int, str, float])
+    self.assertEqual(repr(Union[int, None, List[str]]),
+                     "Union[int, NoneType, Iterable[str]]")
+
+    check = Union[List[int], Dict[str, int]].Compile()
+    for _ in range(1000):
+      self.assertTrue(check({"a": 1}))
+    self.assertTrue(check([1]))
+    self.assertFalse(check("a"))
+
+  def test_typed_attribute(self):
+    class TypedExample(WithMetaclass(TypecheckMeta)):
+      __slots__ = ("plain",)
+      count = Typed[int]
+      names = Typed[Optional[List[str]]]
+
+      def __init__(self, count, names=None):
+        self.count = count
+        self.names = names
+
+    instance = TypedExample(1)
+    self.assertEqual((instance.count, instance.names), (1, None))
+    instance.count = 2
+    self.assertEqual(instance.count, 2)
+    self.assertRaises(TypeError, TypedExample, "1")
+    self.assertRaises(TypeError, setattr, instance, "names", [1])
+    self.assertFalse(hasattr(instance, "__dict__"))
+    try:
+      instance.count = "3"
+    except TypecheckError as e:
+      self.assertEqual(str(e), "Invalid value '3' for attribute count. "
+                       "Expected int")
+    else:
+      self.fail("TypecheckError not raised")
+    with unchecked():
+      instance.count = "4"
+    self.assertEqual(instance.count, "4")
+
+  def test_overhead_budget(self):
+    @typecheck(a=List[int])
+    def Function(a):
+      pass
+
+    messages = []
+    handler = logging.Handler()
+    handler.emit = lambda record: messages.append(record.getMessage())
+    logger = logging.getLogger("safetynet")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    items = list(range(1000))
+    configure(overhead_budget=0.001)
+    try:
+      for _ in range(512):
+        Function(items)
+      self.assertEqual(len(messages), 1)
+      self.assertTrue(messages[0].startswith("Using shallow type checks for "
+                                             "safetynet_tests.Function: "))
+      Function(["a"])
+      self.assertRaises(TypeError, Function, 1)
+
+      for _ in range(512):
+        Function(items)
+      self.assertEqual(len(messages), 2)
+      self.assertTrue(messages[1].startswith("Using sampled type checks"))
+      Function(1)
+
+      budget = Function.type_checks.budget
+      budget.calls = budget.retry_calls - 1
+      Function(items)
+      self.assertEqual(messages[2], "Using shallow type checks for "
+                       "safetynet_tests.Function: retrying after 100000 calls")
+      self.assertRaises(TypeError, Function, 1)
+      self.assertRaises(TypeError, configure, overhead_budget=0)
+    finally:
+      configure(overhead_budget=None)
+      logger.removeHandler(handler)
+      logger.setLevel(logging.NOTSET)
+    self.assertRaises(TypeError, Function, ["a"])
+
+  def test_pickle(self):
+    self.assertIs(pickle.loads(pickle.dumps(PicklableFunction)),
+                  PicklableFunction)
+    self.assertEqual(PicklableFunction.__module__, __name__)
+    self.assertEqual(PicklableExample.Double.__name__, "Double")
+    self.assertIsNot(PicklableFunction.__wrapped__, PicklableFunction)
+    self.assertEqual(pickle.loads(pickle.dumps(PicklableExample())).Double(1),
+                     2)
+
+    pool = multiprocessing.Pool(1)
+    try:
+      self.assertEqual(pool.map(PicklableFunction, [1, 2]), [2, 4])
+      try:
+        pool.apply(PicklableFunction, ("1",))
+      except TypecheckError as e:
+        self.assertEqual(str(e), "Invalid value '1' for argument a. "
+                         "Expected int")
+      else:
+        self.fail("TypecheckError not raised")
+    finally:
+      pool.terminate()
+
+  @unittest.skipIf(sys.version_info < (3, 6), "requires __set_name__")
+  def test_typed_attribute_without_metaclass(self):
+    class TypedExample(object):
+      count = Typed[int]
+
+    instance = TypedExample()
+    instance.count = 1
+    instance.other = "a"
+    self.assertEqual(instance.__dict__, {"count": 1, "other": "a"})
+    self.assertRaises(TypeError, setattr, instance, "count", "1")
@@ -29,10 +29,12 @@ setup(name='safetynet',
       version=version,
       download_url='%s/tarball/%s' % (url, version),
 
-      py_modules=['safetynet'],
+      py_modules=['safetynet', 'safetynet_lint'],
       package_data={'': ['README.md']},
       include_package_data=True,
       install_requires=[],
       tests_require=['nose2'],
-      entry_points={},
+      entry_points={
+        'console_scripts': ['safetynet = safetynet_lint:main'],
+      },
 )